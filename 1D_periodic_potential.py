@@ -3,6 +3,7 @@ import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 from scipy import constants as sc
 from matplotlib.widgets import Slider
+from kronig_penney import KronigPenney
 
 # # Constants and settings
 num_atoms = 5
@@ -19,45 +20,65 @@ atom_positions_2d = np.array([[i * atom_spacing] for i in range(num_atoms)])
 x_wave = np.linspace(-1*(int(num_atoms/2) - 1) * atom_spacing, (int(num_atoms/2) - 1) * atom_spacing, 500)
 m = sc.m_e
 hbar = sc.hbar
-q =  2.283 / atom_spacing # [2.283, 3.141], [4.760, 6.281], [7.463, 9.424]
 C = 1/ np.sqrt(2)
 D = 1/ np.sqrt(2)
-mag_psi = C**2*np.cos(q*x_wave)**2 + D**2*np.sin(q*x_wave)**2 + C*D*np.sin(2*q*x_wave) # könnte auch falsch sein 
+
+def mag_psi(q):
+    # q scalar or array, one row of |psi|^2 over x_wave per q value
+    q = np.asarray(q, dtype=np.float64)[..., None]
+    return C**2*np.cos(q*x_wave)**2 + D**2*np.sin(q*x_wave)**2 + C*D*np.sin(2*q*x_wave) # könnte auch falsch sein 
+
+# Allowed q intervals from the Kronig-Penney solver instead of hand-picked constants
+# thin barriers with barrier_height * barrier_width * atom_spacing / 2 ≈ 5 give q*a ≈ [2.29, 3.14], [4.78, 6.28], [7.48, 9.43]
+barrier_height = 4000
+barrier_width = 0.005
+num_bands = 3
+num_q = 200
+potential = KronigPenney(atom_spacing, barrier_height, barrier_width)
+q_bands = potential.q_bands(num_bands)
+# without band gaps there is only a single band
+num_bands = len(q_bands)
+
+# Precomputed tables: q values and |psi|^2 for every band, shape (num_q,) and (num_q, len(x_wave))
+q_tables = [np.linspace(A, B, num_q) for A, B in q_bands]
+psi_tables = [mag_psi(q) for q in q_tables]
 
 # plt.scatter(atom_positions_2d, np.zeros(len(atom_positions_2d)))
-# plt.plot(x_wave, mag_psi)
+# plt.plot(x_wave, mag_psi(q_tables[0][0]))
 # plt.show()
 
-# Example range for q
-A = 7.463 #4.760 #2.283
-B = 9.424# 6.281 #3.141
-
-# Initial q
-q0 = (A + B) / 2
+# Initial band and q (middle of the band)
+band0 = num_bands - 1
+q_idx0 = num_q // 2
 
 # Create figure and axis
 fig, ax = plt.subplots()
-plt.subplots_adjust(bottom=0.25)
+plt.subplots_adjust(bottom=0.3)
 
 # Initial plot
-line, = ax.plot(x_wave, mag_psi)
+line, = ax.plot(x_wave, psi_tables[band0][q_idx0], label='|psi|^2')
 
 ax.scatter(atom_positions_2d, np.zeros(len(atom_positions_2d)))
-ax.set_title("Adjust q with the slider")
+ax.set_title(f"band {band0 + 1}, q = {q_tables[band0][q_idx0]:.3f}")
 ax.legend()
 ax.grid(True)
 
-# Slider axis: [left, bottom, width, height]
+# Slider axes: [left, bottom, width, height]
+ax_band = plt.axes([0.2, 0.15, 0.6, 0.03])
 ax_slider = plt.axes([0.2, 0.1, 0.6, 0.03])
-slider_q = Slider(ax_slider, 'q', A, B, valinit=q0)
+slider_band = Slider(ax_band, 'band', 1, num_bands, valinit=band0 + 1, valstep=1)
+slider_q = Slider(ax_slider, 'q index', 0, num_q - 1, valinit=q_idx0, valstep=1)
 
-# Update function
+# Update function, only looks up the precomputed tables
 def update(val):
-    q = slider_q.val
-    line.set_ydata(C**2*np.cos(q*x_wave)**2 + D**2*np.sin(q*x_wave)**2 + C*D*np.sin(2*q*x_wave))
+    band = int(slider_band.val) - 1
+    q_idx = int(slider_q.val)
+    line.set_ydata(psi_tables[band][q_idx])
+    ax.set_title(f"band {band + 1}, q = {q_tables[band][q_idx]:.3f}")
     fig.canvas.draw_idle()
 
-# Connect slider to update function
+# Connect sliders to update function
+slider_band.on_changed(update)
 slider_q.on_changed(update)
 ax.set_xlim(-1*(int(num_atoms/2) - 1) * atom_spacing, (int(num_atoms/2) - 1) * atom_spacing)
 
@@ -0,0 +1,229 @@
+import argparse
+from functools import lru_cache
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import plotly
+
+import figure_encoding
+import rdf
+import structures
+
+RESULTS = 'benchmark_results.json'
+BASELINE = 'benchmark_baseline.json'
+# atoms per supercell, 10^3 .. 10^7
+SIZES = (10**3, 10**4, 10**5, 10**6, 10**7)
+QUICK_SIZES = (10**3, 10**4)
+# figures above this many atoms are not built, plotly validation makes them take minutes
+FIGURE_LIMIT = 10**5
+# relative slowdown / memory growth against the baseline that counts as a regression
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.10
+# slowdowns smaller than this are timer noise, not regressions
+MIN_TIME_DELTA = 0.005
+
+
+def supercell_size(name, n_atoms):
+    # half width of the cubic box [-size, size]^3 holding about n_atoms atoms of the structure
+    basis_vectors, atomic_basis = structures.preset(name)
+    volume = abs(np.linalg.det(basis_vectors)) / len(atomic_basis)
+    return 0.5 * (n_atoms * volume) ** (1 / 3)
+
+
+def measure(run, setup=None, repeat=3):
+    # wall times of repeat runs and the tracemalloc peak of one extra run, setup is neither timed nor traced;
+    # returns (times, peak_bytes, result of the last run)
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        result = run(*args)
+        times.append(time.perf_counter() - start)
+    args = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        run(*args)
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return times, peak, result
+
+
+def lattice_cases(sizes):
+    for name in structures.STRUCTURES:
+        for n_atoms in sizes:
+            size = supercell_size(name, n_atoms)
+
+            def run(name=name, size=size):
+                # never served from a lattice_cache, generation is what is measured
+                return structures.build(name, size, cache=False)
+            yield f'lattice/{name}/{n_atoms:.0e}', run, None, lambda lat: {'atoms': int(len(lat.countable_lattice))}
+
+
+@lru_cache(maxsize=None)
+def _fcc_lattice(n_atoms):
+    return structures.build('fcc', supercell_size('fcc', n_atoms), cache=False)
+
+
+@lru_cache(maxsize=None)
+def _fcc_figure(n_atoms):
+    return _fcc_lattice(n_atoms).get_figure()
+
+
+def figure_cases(sizes):
+    # lattices and figures are built in the untimed setup, once per size
+    for n_atoms in (n for n in sizes if n <= FIGURE_LIMIT):
+        yield (f'figure/fcc/{n_atoms:.0e}', lambda lat: lat.get_figure(), lambda n=n_atoms: (_fcc_lattice(n),),
+               lambda fig: {'traces': len(fig.data)})
+        for binary in (False, True):
+            label = 'binary' if binary else 'plain'
+            yield (f'json/{label}/fcc/{n_atoms:.0e}', lambda fig, binary=binary: figure_encoding.to_json(fig, binary),
+                   lambda n=n_atoms: (_fcc_figure(n),), lambda text: {'bytes': len(text)})
+            yield (f'html/{label}/fcc/{n_atoms:.0e}', lambda fig, binary=binary: _write_html(fig, binary),
+                   lambda n=n_atoms: (_fcc_figure(n),), lambda size: {'bytes': size})
+        # nearest neighbour search and the single bond trace, neighbour index included
+        yield (f'bonds/fcc/{n_atoms:.0e}', lambda lat: lat.copy().bonds_trace(), lambda n=n_atoms: (_fcc_lattice(n),),
+               lambda trace: {'bonds': len(trace.x) // 3})
+        yield (f'rdf/fcc/{n_atoms:.0e}', lambda lat: rdf.radial_distribution(lat.copy()),
+               lambda n=n_atoms: (_fcc_lattice(n),), lambda result: {'centers': result['centers']})
+
+
+def _write_html(fig, binary):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'figure.html')
+        figure_encoding.write_html(fig, path, binary=binary, auto_open=False)
+        return os.path.getsize(path)
+
+
+def wigner_seitz_cases():
+    import bcc
+    import plotly.graph_objects as go
+    import wigner_seitz
+
+    def cold():
+        # empty cell cache, so the Voronoi construction is part of the measurement
+        wigner_seitz._cells.clear()
+        return (go.Figure(),)
+    yield 'wigner_seitz/bcc/cold', bcc.add_wigner_seitz_cell, cold, None
+    yield 'wigner_seitz/bcc/cached', bcc.add_wigner_seitz_cell, lambda: (go.Figure(),), None
+
+
+def laguerre_cases(quick):
+    import laguerre_3D as lg
+    for num_frames in (15,) if quick else (15, 60, 240):
+        times = np.arange(num_frames) * (1 / 15)
+
+        def frames(times=times):
+            field = lg.spatial_field(lg.RHO_slice, lg.PHI_slice, lg.z_fixed, lg.z_r, lg.p, lg.l, lg.w_0, lg.k)
+            return lg.animation_frames(field, times, lg.omega)
+        yield f'laguerre/frames/{num_frames}', frames, lg._field_cache.clear, None
+        yield (f'laguerre/figure/{num_frames}', lambda num_frames=num_frames: lg.get_figure(num_frames=num_frames),
+               lg._field_cache.clear, lambda fig: {'frames': len(fig.frames)})
+
+
+def cases(sizes, quick=False):
+    # (name, run, setup, describe): describe maps the result of run to extra numbers worth recording
+    yield from lattice_cases(sizes)
+    yield from figure_cases(sizes)
+    yield from wigner_seitz_cases()
+    yield from laguerre_cases(quick)
+
+
+def _setup(setup):
+    # setup functions that only reset state return None, run then takes no arguments
+    if setup is None:
+        return None
+    return lambda: setup() or ()
+
+
+def run_benchmarks(sizes=SIZES, quick=False, repeat=3, only=None):
+    results = {}
+    for name, run, setup, describe in cases(sizes, quick):
+        if only and not any(pattern in name for pattern in only):
+            continue
+        times, peak, result = measure(run, _setup(setup), repeat)
+        entry = {'time': min(times), 'median': statistics.median(times), 'peak_bytes': peak}
+        if describe:
+            entry.update(describe(result))
+        results[name] = entry
+        print(f'{name:<36} {entry["time"] * 1e3:10.2f} ms {peak / 2**20:10.2f} MiB', flush=True)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'plotly': plotly.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results, baseline, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    # [(name, metric, baseline, current, ratio)] of all results worse than the baseline by more than the tolerance
+    regressions = []
+    for name, entry in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for metric, tolerance in (('time', time_tolerance), ('peak_bytes', memory_tolerance)):
+            if metric == 'time' and entry[metric] - reference[metric] < MIN_TIME_DELTA:
+                continue
+            if reference[metric] > 0 and entry[metric] > reference[metric] * (1 + tolerance):
+                regressions.append((name, metric, reference[metric], entry[metric], entry[metric] / reference[metric]))
+    return regressions
+
+
+def _write(path, data):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time and memory benchmarks for lattice generation, figures, '
+                                                 'serialization, Wigner-Seitz cells and Laguerre-Gauss frames.')
+    parser.add_argument('--sizes', nargs='+', type=float, help='atoms per supercell, default 1e3 .. 1e7')
+    parser.add_argument('--quick', action='store_true', help='small sizes and few frames only')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='+', help='run benchmarks whose name contains one of these strings')
+    parser.add_argument('--output', default=RESULTS)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the new baseline')
+    parser.add_argument('--time-tolerance', type=float, default=TIME_TOLERANCE)
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    sizes = tuple(int(n) for n in args.sizes) if args.sizes else QUICK_SIZES if args.quick else SIZES
+    report = {'environment': environment(), 'results': run_benchmarks(sizes, args.quick, args.repeat, args.only)}
+    _write(args.output, report)
+    print(f'results written to {args.output}')
+
+    if args.save_baseline:
+        _write(args.baseline, report)
+        print(f'baseline written to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}, run with --save-baseline to create one')
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    regressions = compare(report['results'], baseline, args.time_tolerance, args.memory_tolerance)
+    for name, metric, before, after, ratio in regressions:
+        print(f'REGRESSION {name} {metric}: {before:.4g} -> {after:.4g} ({ratio:.2f}x)')
+    print(f'{len(regressions)} regressions against {args.baseline}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
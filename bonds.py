@@ -0,0 +1,69 @@
+import numpy as np
+import plotly.graph_objects as go
+
+from neighbors import NeighborIndex, SHELL_TOLERANCE
+
+# edges of the parallelepiped spanned by three vectors, corners numbered like parallelepiped_corners
+CELL_EDGES = np.array([
+    (0, 1), (0, 2), (0, 3),
+    (1, 4), (1, 5),
+    (2, 4), (2, 6),
+    (3, 5), (3, 6),
+    (4, 7), (5, 7), (6, 7)
+])
+
+
+def find_bonds(points, cutoff=None, shell=1, tol=SHELL_TOLERANCE, index=None):
+    # (i, j, distances) of all bonded pairs i < j, either closer than cutoff or up to the shell-th coordination
+    # shell; index: a neighbors.NeighborIndex over points to reuse (e.g. lattice.neighbor_index()), a periodic
+    # index also bonds across the box faces
+    index = index if index is not None else NeighborIndex(points)
+    if cutoff is None:
+        radii = index.shell_radii(shell, tol)
+        if len(radii) < shell:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0)
+        cutoff = radii[shell - 1]
+    return index.pairs(cutoff + tol)
+
+
+def segments(starts, ends):
+    # (3n, 3) coordinates start, end, NaN per segment, so any number of segments fit into one line trace
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 3)
+    coordinates = np.full((len(starts), 3, 3), np.nan)
+    coordinates[:, 0] = starts
+    coordinates[:, 1] = ends
+    return coordinates.reshape(-1, 3)
+
+
+def line_trace(coordinates, **kwargs):
+    # one Scatter3d in 'lines' mode over NaN separated coordinates
+    kwargs.setdefault('showlegend', False)
+    return go.Scatter3d(x=coordinates[:, 0], y=coordinates[:, 1], z=coordinates[:, 2], mode='lines', **kwargs)
+
+
+def bond_trace(points, i, j, color='gray', width=2, **kwargs):
+    # all bonds (i[n], j[n]) between points as a single line trace; bonds leaving a periodic box are drawn
+    # from the atom towards its nearest image, i.e. sticking out of the box
+    points = np.asarray(points, dtype=np.float64)
+    kwargs.setdefault('name', 'Bonds')
+    return line_trace(segments(points[i], points[j]), line=dict(color=color, width=width), **kwargs)
+
+
+def periodic_bond_trace(index, i, j, **kwargs):
+    # bond_trace of a periodic neighbors.NeighborIndex, every bond drawn with its minimum image length
+    return bond_trace(np.concatenate((index.points[i], index.points[i] + index.displacement(i, j))),
+                      np.arange(len(i)), np.arange(len(i), 2 * len(i)), **kwargs)
+
+
+def parallelepiped_corners(vectors, origin=(0, 0, 0)):
+    a1, a2, a3 = np.asarray(vectors, dtype=np.float64)
+    origin = np.asarray(origin, dtype=np.float64)
+    return origin + np.array([np.zeros(3), a1, a2, a3, a1 + a2, a1 + a3, a2 + a3, a1 + a2 + a3])
+
+
+def cell_edge_trace(vectors, origin=(0, 0, 0), color='black', width=3, **kwargs):
+    # the 12 edges of the cell spanned by vectors as one line trace
+    corners = parallelepiped_corners(vectors, origin)
+    return line_trace(segments(corners[CELL_EDGES[:, 0]], corners[CELL_EDGES[:, 1]]),
+                      line=dict(color=color, width=width), **kwargs)
@@ -0,0 +1,162 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import plotly.graph_objects as go
+
+from lattice import box_cell_ranges, lattice_points
+from wigner_seitz import reciprocal_basis
+
+# upper bound for the number of G x atom phase terms held at once
+BLOCK_ELEMENTS = 4_000_000
+# reflections whose |G| differ by less than this (relative) belong to the same powder peak
+PEAK_TOLERANCE = 1e-6
+CU_K_ALPHA = 1.5406
+# structure types whose peaks are labelled with the indices of the conventional cubic cell, with the number of
+# primitive cells in it
+CUBIC_TYPES = {'sc': 1, 'bcc': 2, 'fcc': 4}
+# largest deviation from integers of the conventional cell edges in the primitive basis
+CELL_TOLERANCE = 1e-6
+
+
+def reciprocal_vectors(basis_vectors, g_max):
+    # (hkl, G) of all reciprocal lattice vectors 0 < |G| <= g_max, G = h*b1 + k*b2 + l*b3
+    b = reciprocal_basis(basis_vectors)
+    origin = np.zeros((1, 3))
+    cell_ranges = box_cell_ranges(b, origin, ((-g_max, g_max),) * 3)
+    hkl = lattice_points(np.eye(3), origin, cell_ranges).astype(np.int64)
+    g = hkl @ b
+    norm = np.linalg.norm(g, axis=1)
+    keep = (norm > 0) & (norm <= g_max * (1 + PEAK_TOLERANCE))
+    return hkl[keep], g[keep]
+
+
+def _structure_factor_block(g, positions, form_factors):
+    s = np.empty(len(g), dtype=np.complex128)
+    rows = max(1, BLOCK_ELEMENTS // max(len(positions), 1))
+    for start in range(0, len(g), rows):
+        phase = g[start:start + rows] @ positions.T
+        s[start:start + rows] = np.exp(1j * phase) @ form_factors
+    return s
+
+
+def structure_factors(g, positions, form_factors=None, workers=None):
+    # S(G) = sum_j f_j exp(i G.r_j) for every row of g, evaluated in blocks of BLOCK_ELEMENTS phase terms
+    # workers > 1 splits the G set over a process pool
+    g = np.asarray(g, dtype=np.float64).reshape(-1, 3)
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    form_factors = np.ones(len(positions)) if form_factors is None else np.asarray(form_factors, dtype=np.complex128)
+    if not workers or workers < 2 or len(g) < 2 * workers:
+        return _structure_factor_block(g, positions, form_factors)
+    parts = np.array_split(g, workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(_structure_factor_block, parts, [positions] * workers, [form_factors] * workers)
+        return np.concatenate(list(results))
+
+
+def lattice_structure_factors(lattice, g_max, form_factors=None, workers=None):
+    # (hkl, G, S) for the Bravais lattice and atomic basis of a lattice.lattice
+    hkl, g = reciprocal_vectors(lattice.basis_vectors, g_max)
+    return hkl, g, structure_factors(g, lattice.atomic_basis, form_factors, workers)
+
+
+def conventional_cell(lattice):
+    # rows of the conventional cell the peaks are labelled in, None to keep the primitive reciprocal indices;
+    # the cube edge follows from the primitive cell volume, and the cube edges have to be lattice vectors
+    # (integer in the basis_vectors), otherwise, e.g. for a rotated or non cubic basis, the labels stay primitive
+    if lattice.structure_type not in CUBIC_TYPES:
+        return None
+    basis_vectors = np.asarray(lattice.basis_vectors, dtype=np.float64)
+    edge = (CUBIC_TYPES[lattice.structure_type] * abs(np.linalg.det(basis_vectors))) ** (1 / 3)
+    cell = edge * np.eye(3)
+    indices = cell @ np.linalg.inv(basis_vectors)
+    if not np.allclose(indices, np.rint(indices), rtol=0, atol=CELL_TOLERANCE):
+        return None
+    return cell
+
+
+def powder_pattern(lattice, wavelength=CU_K_ALPHA, two_theta_max=180.0, form_factors=None, workers=None,
+                   min_intensity=1e-8):
+    # simulated powder peaks: 2theta in degrees, d spacing, multiplicity, intensity normalized to 100
+    # intensity = multiplicity-weighted |S|^2 times the Lorentz-polarization factor
+    # hkl are Miller indices of the conventional cell for the cubic structures (fcc (200), not the primitive
+    # (110)), otherwise indices in the primitive reciprocal basis; 'cell' says which
+    g_max = 4 * np.pi / wavelength * np.sin(np.radians(two_theta_max) / 2)
+    hkl, g, s = lattice_structure_factors(lattice, g_max, form_factors, workers)
+    norm = np.linalg.norm(g, axis=1)
+    if len(norm) == 0:
+        # no reflection within two_theta_max, e.g. a lattice constant below wavelength / 2
+        return dict(two_theta=np.empty(0), d=np.empty(0), hkl=np.empty((0, 3), dtype=np.int64),
+                    multiplicity=np.empty(0, dtype=np.int64), intensity=np.empty(0), cell='primitive')
+    conventional = conventional_cell(lattice)
+    if conventional is not None:
+        # G . A / 2pi are the integer indices of G in the reciprocal basis of the conventional cell A
+        hkl = np.rint(g @ conventional.T / (2 * np.pi)).astype(np.int64)
+    order = np.argsort(norm)
+    hkl, norm, s = hkl[order], norm[order], s[order]
+    # split into peaks wherever |G| jumps
+    starts = np.flatnonzero(np.concatenate(([True], np.diff(norm) > PEAK_TOLERANCE * norm[1:])))
+    multiplicity = np.diff(np.concatenate((starts, [len(norm)])))
+    intensity = np.add.reduceat(np.abs(s) ** 2, starts)
+    # label every peak with its member of largest (h, k, l)
+    group = np.repeat(np.arange(len(starts)), multiplicity)
+    m = int(np.abs(hkl).max(initial=0)) + 1
+    key = ((hkl[:, 0] + m) * (2 * m + 1) + hkl[:, 1] + m) * (2 * m + 1) + hkl[:, 2] + m
+    best = key == np.maximum.reduceat(key, starts)[group]
+    _, first = np.unique(group[best], return_index=True)
+    labels = hkl[np.flatnonzero(best)[first]]
+    theta = np.arcsin(np.clip(norm[starts] * wavelength / (4 * np.pi), 0, 1))
+    lorentz_polarization = (1 + np.cos(2 * theta) ** 2) / (np.sin(theta) ** 2 * np.cos(theta))
+    intensity = intensity * lorentz_polarization
+    if len(intensity) and intensity.max() > 0:
+        intensity = 100 * intensity / intensity.max()
+    keep = intensity > min_intensity
+    return dict(
+        two_theta=np.degrees(2 * theta)[keep],
+        d=(2 * np.pi / norm[starts])[keep],
+        hkl=labels[keep],
+        multiplicity=multiplicity[keep],
+        intensity=intensity[keep],
+        cell='primitive' if conventional is None else 'conventional',
+    )
+
+
+def powder_profile(pattern, two_theta, fwhm=0.2):
+    # peaks broadened with gaussians of the given full width at half maximum, on the grid two_theta
+    sigma = fwhm / (2 * np.sqrt(2 * np.log(2)))
+    profile = np.zeros_like(np.asarray(two_theta, dtype=np.float64))
+    rows = max(1, BLOCK_ELEMENTS // max(len(profile), 1))
+    for start in range(0, len(pattern['two_theta']), rows):
+        centers = pattern['two_theta'][start:start + rows, None]
+        heights = pattern['intensity'][start:start + rows, None]
+        profile += (heights * np.exp(-0.5 * ((two_theta[None, :] - centers) / sigma) ** 2)).sum(axis=0)
+    return profile
+
+
+def get_powder_figure(pattern, fwhm=0.2, points=4000, title='Powder Diffraction Pattern'):
+    fig = go.Figure()
+    two_theta = np.linspace(0, max(pattern['two_theta'].max(initial=0) + 5, 10), points)
+    fig.add_trace(go.Scatter(
+        x=two_theta,
+        y=powder_profile(pattern, two_theta, fwhm),
+        mode='lines',
+        line=dict(color='blue', width=2),
+        name='Profile'
+    ))
+    labels = ['({} {} {})'.format(*hkl) for hkl in pattern['hkl']]
+    fig.add_trace(go.Bar(
+        x=pattern['two_theta'],
+        y=pattern['intensity'],
+        width=0.15,
+        marker=dict(color='red'),
+        text=labels,
+        customdata=pattern['multiplicity'],
+        hovertemplate='2θ=%{x:.3f}°<br>I=%{y:.1f}<br>hkl %{text} (' + pattern.get('cell', 'primitive') +
+                      ' cell)<br>multiplicity %{customdata}<extra></extra>',
+        name='Reflections'
+    ))
+    fig.update_layout(
+        xaxis=dict(title='2θ (°)'),
+        yaxis=dict(title='Intensity'),
+        margin=dict(l=0, r=0, b=0, t=30),
+        title=title
+    )
+    return fig
@@ -0,0 +1,210 @@
+import os
+
+import numpy as np
+
+from lattice import DEFAULT_CHUNK_SIZE, box_index_chunks
+
+# bytes of write buffering of the text formats
+BUFFER_SIZE = 1 << 20
+# the atom count line of XYZ files is written as a placeholder and filled in at the end
+COUNT_WIDTH = 20
+# fixed .npy header length (magic, version and header dict), room for any shape of a 64 bit atom count
+NPY_HEADER_LENGTH = 128
+POSITION_FORMAT = '%.8f'
+# atoms within this fraction of a box length of an upper box face are periodic images of the lower face ones
+FACE_TOLERANCE = 1e-6
+
+
+def lattice_chunks(lat, chunk_size=DEFAULT_CHUNK_SIZE, dtype=np.float64):
+    # (positions, basis_index) of the atoms inside the box of a lattice.lattice, computed block by block from
+    # the integer records, so the full position array is never built or cached
+    basis_index = lat.countable_lattice.basis_index
+    for start, positions in lat.countable_lattice.position_blocks(chunk_size, dtype):
+        block = basis_index[start:start + len(positions)]
+        if lat.mask is not None:
+            keep = lat.mask[start:start + len(positions)]
+            positions, block = positions[keep], block[keep]
+        yield positions, block
+
+
+def box_chunks(basis_vectors, atomic_basis, box, chunk_size=DEFAULT_CHUNK_SIZE, dtype=np.float64):
+    # (positions, basis_index) straight from the generator, no lattice object is built
+    for _, l, points in box_index_chunks(basis_vectors, atomic_basis, box, chunk_size, dtype):
+        yield points, l
+
+
+def _chunks(source, chunk_size):
+    # lattice.lattice, (N, 3) array or an iterable of (positions, basis_index) / positions blocks
+    if hasattr(source, 'countable_lattice'):
+        yield from lattice_chunks(source, chunk_size)
+        return
+    if isinstance(source, np.ndarray):
+        for start in range(0, len(source), chunk_size):
+            block = source[start:start + chunk_size]
+            yield block, np.zeros(len(block), dtype=np.uint8)
+        return
+    for chunk in source:
+        if isinstance(chunk, tuple):
+            yield chunk
+        else:
+            yield chunk, np.zeros(len(chunk), dtype=np.uint8)
+
+
+def _symbols(species, basis_index):
+    # element symbol per atom from the symbol per basis atom
+    if species is None:
+        return np.full(len(basis_index), 'X')
+    return np.asarray(species)[basis_index]
+
+
+def _write_rows(f, symbols, positions, extra=None):
+    line = '%s ' + ' '.join([POSITION_FORMAT] * 3) + (' %d' if extra is not None else '') + '\n'
+    columns = [symbols.tolist()] + [positions[:, d].tolist() for d in range(3)]
+    if extra is not None:
+        columns.append(extra.tolist())
+    f.write(''.join(line % row for row in zip(*columns)))
+
+
+def _box_lattice(box):
+    (x0, x1), (y0, y1), (z0, z1) = box
+    return np.diag([x1 - x0, y1 - y0, z1 - z0]), np.array([x0, y0, z0], dtype=np.float64)
+
+
+def _check_period(source, box):
+    # a lattice.lattice has to be periodic in the box, i.e. the box edges are lattice vectors (the hexagonal
+    # presets, for one, have no orthorhombic period); other sources are trusted
+    if not hasattr(source, 'countable_lattice'):
+        return
+    n = _box_lattice(box)[0] @ np.linalg.inv(source.basis_vectors)
+    if not np.allclose(n, np.rint(n), rtol=0, atol=FACE_TOLERANCE):
+        raise ValueError(f"the box {box} is not a period of the {source.structure_type} lattice, "
+                         f"its edges are not lattice vectors")
+
+
+def _periodic_chunks(source, box, chunk_size):
+    # blocks of source without the atoms on the upper faces of the closed box, the periodic images of those on
+    # the lower faces, so a periodic box holds every atom once
+    cell, origin = _box_lattice(box)
+    upper = np.diag(cell) * (1 - FACE_TOLERANCE)
+    for positions, basis_index in _chunks(source, chunk_size):
+        keep = np.all(positions - origin < upper, axis=1)
+        yield positions[keep], basis_index[keep]
+
+
+def _write_xyz(path, source, species, chunk_size, comment, with_basis=False):
+    # comment: second line, without the newline; returns the number of atoms written
+    n = 0
+    with open(path, 'w', buffering=BUFFER_SIZE, encoding='ascii') as f:
+        f.write(' ' * COUNT_WIDTH + '\n')
+        f.write(comment + '\n')
+        for positions, basis_index in _chunks(source, chunk_size):
+            _write_rows(f, _symbols(species, basis_index), positions, basis_index if with_basis else None)
+            n += len(positions)
+        f.seek(0)
+        f.write(str(n).ljust(COUNT_WIDTH))
+    return n
+
+
+def write_xyz(path, source, species=None, chunk_size=DEFAULT_CHUNK_SIZE, comment=''):
+    # plain XYZ; source: lattice.lattice, (N, 3) array or iterable of blocks (see lattice_chunks / box_chunks)
+    # species: element symbol per basis atom, 'X' if not given
+    return _write_xyz(path, source, species, chunk_size, comment.replace('\n', ' '))
+
+
+def write_extxyz(path, source, box=None, species=None, pbc=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    # extended XYZ with the box as Lattice/Origin, species, positions and the basis index of every atom
+    # pbc: the box is a period of the atoms, the images on its upper faces are left out (see _periodic_chunks)
+    if box is None:
+        box = source.box()
+    cell, origin = _box_lattice(box)
+    if pbc:
+        _check_period(source, box)
+        source = _periodic_chunks(source, box, chunk_size)
+    flag = 'T' if pbc else 'F'
+    comment = (f'Lattice="{" ".join(f"{v:.8f}" for v in cell.ravel())}" '
+               f'Origin="{" ".join(f"{v:.8f}" for v in origin)}" '
+               f'Properties=species:S:1:pos:R:3:basis:I:1 pbc="{flag} {flag} {flag}"')
+    return _write_xyz(path, source, species, chunk_size, comment, with_basis=True)
+
+
+def write_cif(path, source, box=None, species=None, chunk_size=DEFAULT_CHUNK_SIZE, name='supercell'):
+    # P1 CIF of the supercell, the box is the unit cell and positions are stored as fractions of it;
+    # the box has to be a period of the atoms, those on its upper faces are left out (see _periodic_chunks)
+    if box is None:
+        box = source.box()
+    cell, origin = _box_lattice(box)
+    lengths = np.diag(cell)
+    _check_period(source, box)
+    n = 0
+    with open(path, 'w', buffering=BUFFER_SIZE, encoding='ascii') as f:
+        f.write(f'data_{name}\n'
+                f'_symmetry_space_group_name_H-M \'P 1\'\n'
+                f'_symmetry_Int_Tables_number 1\n'
+                f'_cell_length_a {lengths[0]:.8f}\n'
+                f'_cell_length_b {lengths[1]:.8f}\n'
+                f'_cell_length_c {lengths[2]:.8f}\n'
+                f'_cell_angle_alpha 90\n'
+                f'_cell_angle_beta 90\n'
+                f'_cell_angle_gamma 90\n'
+                f'loop_\n'
+                f'_atom_site_type_symbol\n'
+                f'_atom_site_fract_x\n'
+                f'_atom_site_fract_y\n'
+                f'_atom_site_fract_z\n')
+        for positions, basis_index in _periodic_chunks(source, box, chunk_size):
+            _write_rows(f, _symbols(species, basis_index), (positions - origin) / lengths)
+            n += len(positions)
+    return n
+
+
+def _npy_header(dtype, n):
+    header = repr({'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False,
+                   'shape': (n, 3)})
+    # magic (6) + version (2) + header length (2) + header padded with spaces, newline terminated
+    length = NPY_HEADER_LENGTH - 10
+    return b'\x93NUMPY\x01\x00' + length.to_bytes(2, 'little') + header.ljust(length - 1).encode('latin1') + b'\n'
+
+
+def write_npy(path, source, dtype=np.float64, chunk_size=DEFAULT_CHUNK_SIZE):
+    # (N, 3) positions as .npy, written block by block; the header is written with a placeholder shape and
+    # rewritten once the atom count is known, so generators of unknown length can be streamed
+    dtype = np.dtype(dtype).newbyteorder('<')
+    n = 0
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'wb', buffering=BUFFER_SIZE) as f:
+            f.write(_npy_header(dtype, 0))
+            for positions, _ in _chunks(source, chunk_size):
+                f.write(np.ascontiguousarray(positions, dtype=dtype).tobytes())
+                n += len(positions)
+            f.seek(0)
+            f.write(_npy_header(dtype, n))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return n
+
+
+def open_npy(path, mode='r'):
+    # memory map of a written .npy, pages are only loaded when accessed
+    return np.load(path, mmap_mode=mode)
+
+
+def iter_npy(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    # blocks of a (possibly huge) .npy, each copied out of the memory map
+    positions = open_npy(path)
+    for start in range(0, len(positions), chunk_size):
+        yield np.array(positions[start:start + chunk_size])
+
+
+WRITERS = {'.xyz': write_xyz, '.extxyz': write_extxyz, '.cif': write_cif, '.npy': write_npy}
+
+
+def export(path, source, **kwargs):
+    # writer chosen by the file extension
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in WRITERS:
+        raise ValueError(f"unknown format {extension!r}, choose one of {', '.join(WRITERS)}")
+    return WRITERS[extension](path, source, **kwargs)
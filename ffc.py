@@ -1,3 +1,5 @@
+import sys
+
 import plotly.graph_objects as go
 import numpy as np
 
@@ -22,12 +24,20 @@ def generate_fcc_lattice(a=1.0, nx=2, ny=2, nz=2):
 
     return np.array(lattice_points)
 
-# Generate FCC lattice points
-a = 1.0  # lattice constant
-nx, ny, nz = 3, 3, 3  # number of unit cells in each direction
-points = generate_fcc_lattice(a, nx, ny, nz)
+if __name__ == '__main__':
+    # Generate FCC lattice points
+    a = 1.0  # lattice constant
+    nx, ny, nz = 3, 3, 3  # number of unit cells in each direction
+    points = generate_fcc_lattice(a, nx, ny, nz)
 
-print(points)
+    if len(sys.argv) > 1:
+        # python ffc.py points.xyz|.extxyz|.cif|.npy
+        import exporters
+        # the cells (i, j, k) with 0 <= i < nx, ... fill the periodic box [0, a * nx) x ...
+        box = [(0, a * nx), (0, a * ny), (0, a * nz)]
+        exporters.export(sys.argv[1], points, **({} if sys.argv[1].endswith(('.xyz', '.npy')) else {'box': box}))
+    else:
+        print(points)
 
 # # Create a 3D scatter plot
 # fig = go.Figure()
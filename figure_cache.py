@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import pickle
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+MAX_ENTRIES = 32
+MAX_BYTES = 512 * 2**20
+MAX_DISK_BYTES = 4 * 2**30
+SUFFIX = '.pkl'
+
+
+def params_key(params):
+    # stable hash of a JSON-like parameter dict, independent of key order
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def estimate_nbytes(value, seen=None):
+    # rough in-memory size of a cached value without serializing it: array buffers, Python containers
+    # (lists of numbers from their first element) and the attributes of objects, shared objects counted once
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_nbytes(key, seen) + estimate_nbytes(item, seen)
+                                          for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        if value and isinstance(value[0], (int, float)):
+            return sys.getsizeof(value) + len(value) * sys.getsizeof(value[0])
+        return sys.getsizeof(value) + sum(estimate_nbytes(item, seen) for item in value)
+    if hasattr(value, '__dict__'):
+        return sys.getsizeof(value) + estimate_nbytes(vars(value), seen)
+    return sys.getsizeof(value)
+
+
+class FigureCache:
+    # two tier cache of generated lattices and prebuilt figures keyed by params_key:
+    # an in-process LRU bounded by entry count and estimated size, and an optional directory of pickles
+    # shared by all worker processes, bounded by total size and evicted by last access time
+    # the pickles are loaded as they are, so disk_dir must only be writable by trusted users: whoever can
+    # write a file there can run code in every process reading it
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, disk_dir=None, max_disk_bytes=MAX_DISK_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        self.lock = threading.Lock()
+        # one lock per key being built, so concurrent requests for the same parameters build once
+        self.building = {}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries or (self.disk_dir is not None and os.path.exists(self._path(key)))
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + SUFFIX)
+
+    def _count(self, stat):
+        self.stats[stat] += 1
+        metrics.observe(f'cache.{stat}', 1)
+
+    def _lookup(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self._count('hits')
+                return True, self.entries[key][0]
+        return False, None
+
+    def get(self, key, default=None):
+        found, value = self._lookup(key)
+        if found:
+            return value
+        blob = self._read(key)
+        if blob is None:
+            return default
+        value = pickle.loads(blob)
+        with self.lock:
+            self._count('disk_hits')
+        self._insert(key, value, len(blob))
+        return value
+
+    def get_or_build(self, key, build, disk=True):
+        # value for key from memory, disk or build(); disk=False keeps process local values off the disk tier
+        found, value = self._lookup(key)
+        if found:
+            return value
+        with self.lock:
+            key_lock = self.building.setdefault(key, threading.Lock())
+        with key_lock:
+            value = self.get(key) if disk else self._lookup(key)[1]
+            if value is None:
+                with self.lock:
+                    self._count('misses')
+                with metrics.timer('cache.build'):
+                    value = build()
+                self.put(key, value, disk)
+        with self.lock:
+            self.building.pop(key, None)
+        return value
+
+    def put(self, key, value, disk=True, nbytes=None):
+        # nbytes: size of value if the caller knows it, else the pickle size when it goes to disk anyway and
+        # estimate_nbytes otherwise; process local values (disk=False) are never pickled
+        if disk and self.disk_dir:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            self._insert(key, value, len(blob) if nbytes is None else nbytes)
+            self._write(key, blob)
+        else:
+            self._insert(key, value, estimate_nbytes(value) if nbytes is None else nbytes)
+
+    def _insert(self, key, value, nbytes):
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            # the newest entry always stays, even if it alone exceeds max_bytes
+            while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.nbytes > self.max_bytes):
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nbytes -= evicted
+                self._count('evictions')
+
+    def _read(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+            # access time for the LRU order of the disk tier
+            os.utime(path)
+        except OSError:
+            return None
+        return blob
+
+    def _write(self, key, blob):
+        # write to a temporary file in the same directory and rename, readers never see partial files
+        fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._trim_disk()
+
+    def _trim_disk(self):
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith(SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.disk_dir, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files)[:-1]:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.disk_dir, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self, disk=False):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+        if disk and self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith(SUFFIX):
+                    os.remove(os.path.join(self.disk_dir, name))
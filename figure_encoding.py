@@ -0,0 +1,99 @@
+import base64
+import json
+import time
+import numpy as np
+import plotly.io as pio
+from plotly.utils import PlotlyJSONEncoder
+import metrics
+
+# trace attributes that carry per-point data worth encoding
+ARRAY_KEYS = ('x', 'y', 'z', 'u', 'v', 'w', 'i', 'j', 'k', 'intensity', 'value', 'surfacecolor')
+# shorter arrays are not worth the base64 overhead
+MIN_LENGTH = 16
+
+
+def encode_array(values, dtype='f4'):
+    # plotly.js typed array spec: {'dtype': ..., 'bdata': base64 of the little-endian buffer}
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu':
+        low, high = int(values.min(initial=0)), int(values.max(initial=0))
+        if low >= 0 and high <= np.iinfo(np.uint32).max:
+            dtype = 'u4'
+        elif np.iinfo(np.int32).min <= low and high <= np.iinfo(np.int32).max:
+            dtype = 'i4'
+        else:
+            # outside 32 bits, f8 holds the same numbers plotly.js would parse from a plain list
+            dtype = 'f8'
+    array = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+    encoded = {'dtype': dtype, 'bdata': base64.b64encode(array.tobytes()).decode('ascii')}
+    if array.ndim > 1:
+        encoded['shape'] = ','.join(str(n) for n in array.shape)
+    return encoded
+
+
+def decode_array(encoded):
+    array = np.frombuffer(base64.b64decode(encoded['bdata']), dtype=np.dtype(encoded['dtype']).newbyteorder('<'))
+    if 'shape' in encoded:
+        array = array.reshape([int(n) for n in str(encoded['shape']).split(',')])
+    return array
+
+
+def _typed(values):
+    return isinstance(values, dict) and 'bdata' in values and 'dtype' in values
+
+
+def _numeric(values):
+    if _typed(values):
+        return True
+    if isinstance(values, np.ndarray):
+        return values.dtype.kind in 'iuf' and values.size >= MIN_LENGTH
+    if isinstance(values, (list, tuple)) and len(values) >= MIN_LENGTH:
+        return all(isinstance(v, (int, float, np.number)) and not isinstance(v, bool) for v in values)
+    return False
+
+
+def _encode_value(value, dtype):
+    # dtype None: plain number lists, otherwise a typed array of that dtype
+    if _typed(value):
+        value = decode_array(value)
+    if dtype is None:
+        return np.asarray(value).tolist()
+    return encode_array(value, dtype)
+
+
+def _encode_trace(trace, dtype):
+    return {key: _encode_value(value, dtype) if key in ARRAY_KEYS and _numeric(value) else value
+            for key, value in trace.items()}
+
+
+@metrics.timed('figure.encode')
+def encode_figure(fig, dtype='f4'):
+    # figure dict with all large numeric trace arrays (also in frames) as base64 typed arrays
+    # newer plotly versions already emit float64 typed arrays, those are re-encoded to dtype
+    fig = fig.to_plotly_json() if hasattr(fig, 'to_plotly_json') else dict(fig)
+    fig['data'] = [_encode_trace(trace, dtype) for trace in fig.get('data', [])]
+    if fig.get('frames'):
+        fig['frames'] = [dict(frame, data=[_encode_trace(trace, dtype) for trace in frame.get('data', [])])
+                         for frame in fig['frames']]
+    return fig
+
+
+def to_json(fig, binary=False, dtype='f4'):
+    # binary=False gives plain JSON number lists, as Dash callbacks and older plotly versions send them
+    return json.dumps(encode_figure(fig, dtype if binary else None), cls=PlotlyJSONEncoder)
+
+
+def write_html(fig, path, binary=False, dtype='f4', **kwargs):
+    kwargs.setdefault('validate', False)
+    pio.write_html(encode_figure(fig, dtype if binary else None), path, **kwargs)
+
+
+def payload_report(fig, dtype='f4'):
+    # size and encoding time of the plain JSON payload vs. the typed array one
+    report = {}
+    for name, binary in (('json', False), ('binary', True)):
+        start = time.perf_counter()
+        payload = to_json(fig, binary, dtype)
+        report[name] = {'bytes': len(payload.encode('utf-8')), 'seconds': time.perf_counter() - start}
+    report['ratio'] = report['json']['bytes'] / max(report['binary']['bytes'], 1)
+    return report
@@ -0,0 +1,280 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+
+import numpy as np
+
+import lattice_cache
+import metrics
+from figure_cache import params_key
+
+# finished jobs kept for result()/status() after completion
+MAX_FINISHED = 64
+# minimum seconds between two progress writes of a job
+PROGRESS_INTERVAL = 0.1
+
+PENDING, RUNNING, DONE, ERROR, CANCELLED = 'pending', 'running', 'done', 'error', 'cancelled'
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Progress:
+    # handed to every job function as progress=; reports through small files in the job directory,
+    # so the serving process (or any other process sharing the directory) can read it and request cancellation
+
+    def __init__(self, job_dir, job_id):
+        self.path = os.path.join(job_dir, job_id + '.progress')
+        self.cancel_path = os.path.join(job_dir, job_id + '.cancel')
+        self.last = 0.0
+
+    def __call__(self, done, total=1, message=''):
+        # also raises JobCancelled, so every progress report is a cancellation point
+        self.check()
+        now = time.monotonic()
+        if now - self.last < PROGRESS_INTERVAL and done < total:
+            return
+        self.last = now
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'done': float(done), 'total': float(total), 'message': message}, f)
+        os.replace(tmp, self.path)
+
+    def cancelled(self):
+        return os.path.exists(self.cancel_path)
+
+    def check(self):
+        if self.cancelled():
+            raise JobCancelled()
+
+
+def _job_value(value):
+    # JSON value identifying the content of a job argument: arrays by a hash of their data, lattices by their
+    # lattice_cache.lattice_key and current box; TypeError for anything else, such jobs are never shared
+    import lattice
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic) and not isinstance(value, np.object_):
+        return value.item()
+    if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        data = np.ascontiguousarray(value)
+        return {'ndarray': hashlib.sha256(data.tobytes()).hexdigest(), 'dtype': data.dtype.str,
+                'shape': list(data.shape)}
+    if isinstance(value, lattice.lattice):
+        box = value.box()
+        return {'lattice': lattice_cache.lattice_key(value.basis_vectors, value.atomic_basis, box,
+                                                     value.position_dtype),
+                'box': [[float(lo), float(hi)] for lo, hi in box]}
+    if isinstance(value, (list, tuple)):
+        return [_job_value(item) for item in value]
+    if isinstance(value, dict) and all(isinstance(key, str) for key in value):
+        return {key: _job_value(item) for key, item in value.items()}
+    raise TypeError(f"cannot identify a job argument of type {type(value).__name__}")
+
+
+def _run(job_dir, job_id, func, args, kwargs):
+    return func(*args, progress=Progress(job_dir, job_id), **kwargs)
+
+
+class Job:
+
+    def __init__(self, job_id, name, future):
+        self.id = job_id
+        self.name = name
+        self.future = future
+        self.started = time.time()
+        self.finished = None
+        # sessions waiting for the result, the job is cancelled when the last one lets go
+        self.refs = 1
+
+
+class JobManager:
+    # runs job functions func(*args, progress=..., **kwargs) on a process pool;
+    # identical submissions (same function and arguments) share one job while it runs or its result is kept,
+    # submissions with arguments _job_value cannot identify always get a job of their own
+
+    def __init__(self, max_workers=None, job_dir=None):
+        self.pool = ProcessPoolExecutor(max_workers=max_workers)
+        self.job_dir = job_dir or tempfile.mkdtemp(prefix='qts_jobs_')
+        os.makedirs(self.job_dir, exist_ok=True)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def job_id(self, func, args, kwargs):
+        # content hash of the call, None if an argument cannot be identified
+        try:
+            return params_key({'func': f'{func.__module__}.{func.__qualname__}', 'args': _job_value(args),
+                               'kwargs': _job_value(kwargs)})
+        except TypeError:
+            return None
+
+    def submit(self, func, *args, **kwargs):
+        job_id = self.job_id(func, args, kwargs)
+        shared = job_id is not None
+        job_id = job_id if shared else uuid.uuid4().hex
+        with self.lock:
+            job = self.jobs.get(job_id) if shared else None
+            if job is not None and self._state(job) not in (CANCELLED, ERROR):
+                job.refs += 1
+                metrics.observe('jobs.deduplicated', 1)
+                return job_id
+            self._remove_files(job_id)
+            future = self.pool.submit(_run, self.job_dir, job_id, func, args, kwargs)
+            self.jobs[job_id] = Job(job_id, func.__name__, future)
+            future.add_done_callback(lambda _, job_id=job_id: self._finished(job_id))
+            self._trim()
+        return job_id
+
+    def _finished(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.finished = time.time()
+                metrics.observe(f'jobs.time[{job.name}]', job.finished - job.started)
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.future.done()]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            del self.jobs[job_id]
+            self._remove_files(job_id)
+
+    def _remove_files(self, job_id):
+        for suffix in ('.progress', '.cancel'):
+            try:
+                os.remove(os.path.join(self.job_dir, job_id + suffix))
+            except OSError:
+                pass
+
+    def _state(self, job):
+        future = job.future
+        if future.cancelled():
+            return CANCELLED
+        if future.done():
+            error = future.exception()
+            if isinstance(error, JobCancelled):
+                return CANCELLED
+            return ERROR if error is not None else DONE
+        return RUNNING if future.running() else PENDING
+
+    def _progress(self, job_id):
+        try:
+            with open(os.path.join(self.job_dir, job_id + '.progress'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'done': 0.0, 'total': 1.0, 'message': ''}
+
+    def status(self, job_id):
+        # {'state', 'progress' (0..1), 'message', 'error'}, None for unknown jobs
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        state = self._state(job)
+        progress = self._progress(job_id)
+        fraction = 1.0 if state == DONE else progress['done'] / progress['total'] if progress['total'] else 0.0
+        status = {'state': state, 'progress': min(max(fraction, 0.0), 1.0), 'message': progress['message'],
+                  'error': None}
+        if state == ERROR:
+            status['error'] = repr(job.future.exception())
+        return status
+
+    def result(self, job_id, timeout=None):
+        job = self.jobs[job_id]
+        try:
+            return job.future.result(timeout)
+        except CancelledError:
+            raise JobCancelled()
+
+    def release(self, job_id):
+        # one waiting session is no longer interested; cancels the job when nobody else waits for it
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.future.done():
+                return
+            job.refs -= 1
+            if job.refs <= 0:
+                self._cancel(job)
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                self._cancel(job)
+
+    def _cancel(self, job):
+        # pending jobs never start, running ones stop at their next progress report
+        if not job.future.cancel():
+            open(os.path.join(self.job_dir, job.id + '.cancel'), 'w').close()
+        metrics.observe('jobs.cancelled', 1)
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            for job in self.jobs.values():
+                if not job.future.done():
+                    self._cancel(job)
+        self.pool.shutdown(wait=wait, cancel_futures=True)
+
+
+# job functions, they run in the pool and must be importable module level functions;
+# progress is optional so they can also be called directly
+
+def _no_progress(done, total=1, message=''):
+    pass
+
+
+def build_lattice(structure, size, a=1.0, c=None, progress=None):
+    import structures
+    progress = progress or _no_progress
+    return structures.build(structure, size, a, c, progress=lambda done, total: progress(done, total, 'generating atoms'))
+
+
+def build_session(params, lod=False, max_points=None, binary=False, bonds=None, progress=None):
+    # (session entry, LevelOfDetail or None) of lattice.LatticeVisualizer for the session parameters
+    import lattice
+    progress = progress or _no_progress
+    lat = build_lattice(params['structure'], params['size'], params['a'],
+                        progress=lambda done, total, message: progress(0.8 * done, total, message))
+    progress(0.8, 1, 'building figure')
+    return lattice.session_entry(lat, lod, max_points or lattice.DEFAULT_MAX_POINTS, binary, bonds=bonds)
+
+
+def neighbor_shells(lat, n_shells=3, progress=None):
+    # coordination shells of a lattice.lattice, see neighbors.NeighborIndex.coordination_shells
+    progress = progress or _no_progress
+    progress(0, 2, 'building neighbor index')
+    index = lat.neighbor_index()
+    progress(1, 2, 'searching shells')
+    return index.coordination_shells(n_shells)
+
+
+def powder_pattern(lat, wavelength=None, two_theta_max=180.0, progress=None):
+    import diffraction
+    (progress or _no_progress)(0, 1, 'structure factors')
+    return diffraction.powder_pattern(lat, wavelength or diffraction.CU_K_ALPHA, two_theta_max)
+
+
+def radial_distribution(lat, r_max=None, bins=200, periodic=False, progress=None):
+    # g(r) of a lattice.lattice, see rdf.radial_distribution, reported per block of centre atoms
+    import rdf
+    progress = progress or _no_progress
+    return rdf.radial_distribution(lat, r_max, bins, periodic,
+                                   progress=lambda done, total: progress(done, total, 'counting pairs'))
+
+
+def band_structure(basis_vectors, atomic_basis, hoppings, k, chunk_size=10_000, progress=None):
+    # tight binding bands along the k-points, reported per chunk
+    import tight_binding
+    progress = progress or _no_progress
+    model = tight_binding.TightBinding(basis_vectors, atomic_basis, hoppings)
+    k = np.asarray(k, dtype=np.float64).reshape(-1, 3)
+    bands = np.empty((len(k), model.n_basis))
+    for start in range(0, len(k), chunk_size):
+        progress(start, len(k), 'diagonalizing')
+        bands[start:start + chunk_size] = model.bands(k[start:start + chunk_size])
+    return bands
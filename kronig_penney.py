@@ -0,0 +1,106 @@
+from functools import lru_cache
+import numpy as np
+from scipy.optimize import brentq
+
+# units with hbar^2 / 2m = 1, so E = q^2 for the wave number q inside the well
+ENERGY_GRID = 20000
+# times bands() doubles its search range before giving up
+MAX_DOUBLINGS = 20
+
+
+def dispersion(E, period, barrier_height, barrier_width):
+    # right hand side f(E) of cos(k a) = f(E) for a rectangular barrier of height V0 and width b
+    # per period a; energies with |f(E)| <= 1 are allowed
+    # a negative V0 is a well: f is symmetric in the two regions, so it is the barrier -V0 of width a - b
+    # at energies measured from V0
+    E = np.asarray(E, dtype=np.float64)
+    if barrier_height < 0:
+        return dispersion(E - barrier_height, period, -barrier_height, period - barrier_width)
+    V0, b = barrier_height, barrier_width
+    w = period - b
+    q = np.sqrt(np.maximum(E, 1e-300))
+    f = np.empty_like(E)
+    below = E < V0
+    if np.any(below):
+        kappa = np.sqrt(V0 - E[below])
+        qb = q[below]
+        f[below] = (np.cos(qb * w) * np.cosh(kappa * b)
+                    + (kappa**2 - qb**2) / (2 * qb * kappa) * np.sin(qb * w) * np.sinh(kappa * b))
+    above = ~below
+    if np.any(above):
+        beta = np.sqrt(np.maximum(E[above] - V0, 1e-300))
+        qa = q[above]
+        f[above] = (np.cos(qa * w) * np.cos(beta * b)
+                    - (qa**2 + beta**2) / (2 * qa * beta) * np.sin(qa * w) * np.sin(beta * b))
+    return f
+
+
+@lru_cache(maxsize=None)
+def band_edges(period, barrier_height, barrier_width, e_max, n_grid=ENERGY_GRID):
+    # ((E_lo, E_hi), ...) of all allowed bands below e_max, from sign changes of f -/+ 1 on a dense energy
+    # grid from the potential minimum min(0, V0) up, refined by root bracketing; cached per potential
+    e_min = min(0.0, barrier_height)
+    E = np.linspace(e_min + (e_max - e_min) / n_grid, e_max, n_grid)
+    f = dispersion(E, period, barrier_height, barrier_width)
+    allowed = np.abs(f) <= 1
+    changes = np.flatnonzero(np.diff(allowed.astype(np.int8)))
+
+    def edge(i):
+        # |f| crosses 1 between E[i] and E[i + 1], on the side of the sign of f there
+        target = 1.0 if f[i] + f[i + 1] > 0 else -1.0
+        return brentq(lambda e: dispersion(np.array([e]), period, barrier_height, barrier_width)[0] - target,
+                      E[i], E[i + 1])
+
+    edges = [edge(i) for i in changes]
+    if allowed[0]:
+        edges.insert(0, e_min)
+    if allowed[-1]:
+        edges.append(e_max)
+    return tuple(zip(edges[0::2], edges[1::2]))
+
+
+class KronigPenney:
+    # 1D periodic potential: barriers of height barrier_height and width barrier_width, period period
+
+    def __init__(self, period, barrier_height, barrier_width):
+        self.period = period
+        self.barrier_height = barrier_height
+        self.barrier_width = barrier_width
+
+    def dispersion(self, E):
+        return dispersion(E, self.period, self.barrier_height, self.barrier_width)
+
+    @property
+    def e_min(self):
+        # bottom of the potential, no state lies below it
+        return min(0.0, self.barrier_height)
+
+    def bands(self, n_bands=3, e_max=None):
+        # energy intervals of the lowest n_bands allowed bands
+        # without e_max the search range above e_min grows until enough bands are found
+        # without gaps (no barrier, or none resolved on the energy grid) everything up to e_max is one band
+        e_max = e_max or self.e_min + (n_bands * np.pi / self.period) ** 2 * 1.5
+        for _ in range(MAX_DOUBLINGS):
+            edges = band_edges(self.period, self.barrier_height, self.barrier_width, float(e_max))
+            if edges == ((self.e_min, float(e_max)),):
+                # f never left [-1, 1]: free electron like, a single band
+                return edges
+            # the last band may be cut off at e_max
+            if len(edges) > n_bands or (len(edges) == n_bands and edges[-1][1] < e_max):
+                return edges[:n_bands]
+            searched = e_max
+            e_max = self.e_min + 2 * (e_max - self.e_min)
+        raise ValueError(f"found only {len(edges)} of {n_bands} bands below E = {searched:g}")
+
+    def q_bands(self, n_bands=3):
+        # the same bands as intervals of the wave number q = sqrt(E - e_min) in the region of lower potential
+        return tuple((np.sqrt(lo - self.e_min), np.sqrt(hi - self.e_min)) for lo, hi in self.bands(n_bands))
+
+    def band_structure(self, n_bands=3, n_points=200):
+        # [(k, E)] per band, E sampled between the band edges and k in [0, pi / a]
+        structure = []
+        for lo, hi in self.bands(n_bands):
+            E = np.linspace(lo, hi, n_points)
+            k = np.arccos(np.clip(self.dispersion(E), -1, 1)) / self.period
+            structure.append((k, E))
+        return structure
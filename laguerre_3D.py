@@ -1,8 +1,9 @@
 import numpy as np
 from scipy.special import genlaguerre
 import plotly.graph_objs as go
-from plotly.offline import plot
 import math
+import figure_encoding
+from laguerre_modes import wavefront_radius, spot_radius, guoy_phase
 
 # Beam parameters
 z_r = 1
@@ -29,21 +30,13 @@ RHO_slice = RHO[:, :, z_idx]
 PHI_slice = PHI[:, :, z_idx]
 
 # Functions
-def wavefront_radius(z, z_r):
-    return (z_r**2 + z**2) / z
-
-def spot_radius(z, z_r, w_0):
-    return w_0 * np.sqrt(1 + z**2 / z_r**2)
-
-def guoy_phase(z, z_r, p, l):
-    return (2*p + np.abs(l) + 1) * np.arctan(z / z_r)
-
 def amplitude(rho, phi, z, z_r, p, l, w_0, k):
+    w = spot_radius(z, z_r, w_0)
     temp1 = np.sqrt(2 * math.factorial(p) / (np.pi * math.factorial(p + np.abs(l))))
-    temp2 = (np.sqrt(2) * rho / spot_radius(z, z_r, w_0))**np.abs(l)
+    temp2 = (np.sqrt(2) * rho / w)**np.abs(l)
     L = genlaguerre(p, np.abs(l))
-    temp3 = L(2 * rho**2 / spot_radius(z, z_r, w_0)**2) * w_0 / spot_radius(z, z_r, w_0)
-    temp4 = np.exp(-rho**2 / spot_radius(z, z_r, w_0)**2 
+    temp3 = L(2 * rho**2 / w**2) * w_0 / w
+    temp4 = np.exp(-rho**2 / w**2 
                    - 1j * k * rho**2 / (2 * wavefront_radius(z, z_r))
                    + 1j * l * phi 
                    - 1j * guoy_phase(z, z_r, p, l))
@@ -53,27 +46,44 @@ def complex_amplitude(rho, phi, z, z_r, p, l, w_0, k, omega, t):
     amp = amplitude(rho, phi, z, z_r, p, l, w_0, k)
     return amp * np.exp(1j * (k * z - omega * t))
 
-# Create frames for animation
-frames = []
-num_frames = 60
-
-for i in range(num_frames):
-    t = i / 15  # Time step
-    Znew = np.real(complex_amplitude(RHO_slice, PHI_slice, z_fixed, z_r, p, l, w_0, k, omega, t))
-    Znew /= np.max(np.abs(Znew))
-
-    frame = go.Frame(
-        data=[go.Surface(z=Znew, x=X_slice, y=Y_slice, colorscale='RdBu', cmin=-1, cmax=1)],
-        name=str(i)
-    )
-    frames.append(frame)
-
-# Initial data
-Z0 = np.real(complex_amplitude(RHO_slice, PHI_slice, z_fixed, z_r, p, l, w_0, k, omega, 0))
-Z0 /= np.max(np.abs(Z0))
-
-# Plotly surface
-surface = go.Surface(z=Z0, x=X_slice, y=Y_slice, colorscale='RdBu', cmin=-1, cmax=1)
+# Spatial field cache: only exp(-i omega t) changes between frames
+_field_cache = {}
+
+def spatial_field(rho, phi, z, z_r, p, l, w_0, k):
+    # amplitude * exp(ikz), evaluated once per (p, l, z), beam parameters and grid
+    key = (p, l, z, z_r, w_0, k, rho.shape, hash(rho.tobytes()), hash(phi.tobytes()))
+    if key not in _field_cache:
+        _field_cache[key] = amplitude(rho, phi, z, z_r, p, l, w_0, k) * np.exp(1j * k * z)
+    return _field_cache[key]
+
+def animation_frames(field, times, omega):
+    # Re(field * exp(-i omega t)) for all times at once, shape (frames, rho, phi),
+    # every frame normalized to max |value| = 1
+    times = np.asarray(times, dtype=np.float64)[:, None, None]
+    frames = field.real * np.cos(omega * times) + field.imag * np.sin(omega * times)
+    frames /= np.abs(frames).max(axis=(1, 2), keepdims=True)
+    return frames
+
+def animation_figure(Z_frames, X, Y, layout, compact=True, decimate=1):
+    # compact: frames only carry z, the static x/y grid is stored once on the base surface;
+    # all arrays float32 so write_html(binary=True) can ship them as typed arrays
+    # decimate: keep every n-th grid point in both directions
+    step = slice(None, None, decimate)
+    X, Y, Z_frames = X[step, step], Y[step, step], Z_frames[:, step, step]
+    if compact:
+        X, Y, Z_frames = X.astype(np.float32), Y.astype(np.float32), Z_frames.astype(np.float32)
+        frames = [go.Frame(data=[go.Surface(z=Z_frames[i])], traces=[0], name=str(i))
+                  for i in range(len(Z_frames))]
+    else:
+        frames = [
+            go.Frame(
+                data=[go.Surface(z=Z_frames[i], x=X, y=Y, colorscale='RdBu', cmin=-1, cmax=1)],
+                name=str(i)
+            )
+            for i in range(len(Z_frames))
+        ]
+    surface = go.Surface(z=Z_frames[0], x=X, y=Y, colorscale='RdBu', cmin=-1, cmax=1)
+    return go.Figure(data=[surface], layout=layout, frames=frames)
 
 layout = go.Layout(
     title='Interactive 3D Wave (Real Part)',
@@ -90,7 +100,21 @@ layout = go.Layout(
     )]
 )
 
-fig = go.Figure(data=[surface], layout=layout, frames=frames)
+def get_figure(p=p, l=l, num_frames=60, frame_step=1 / 15, compact=True, decimate=1):
+    # Create frames for animation
+    times = np.arange(num_frames) * frame_step
+    field = spatial_field(RHO_slice, PHI_slice, z_fixed, z_r, p, l, w_0, k)
+    Z_frames = animation_frames(field, times, omega)
+    return animation_figure(Z_frames, X_slice, Y_slice, layout, compact, decimate)
+
+if __name__ == '__main__':
+    # Animation/export settings
+    num_frames = 60
+    frame_step = 1 / 15  # Time step
+    compact = True
+    decimate = 1
+
+    fig = get_figure(p, l, num_frames, frame_step, compact, decimate)
 
-# Save to interactive HTML
-plot(fig, filename='interactive_wave.html', auto_open=False)
+    # Save to interactive HTML
+    figure_encoding.write_html(fig, 'interactive_wave.html', binary=compact, auto_open=False)
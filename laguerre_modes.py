@@ -0,0 +1,127 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import math
+import numpy as np
+import plotly.graph_objs as go
+from scipy.special import genlaguerre
+
+# number of z planes evaluated together
+SLAB_SIZE = 8
+
+
+# Beam functions
+def wavefront_radius(z, z_r):
+    return (z_r**2 + z**2) / z
+
+def spot_radius(z, z_r, w_0):
+    return w_0 * np.sqrt(1 + z**2 / z_r**2)
+
+def guoy_phase(z, z_r, p, l):
+    return (2*p + np.abs(l) + 1) * np.arctan(z / z_r)
+
+
+@lru_cache(maxsize=None)
+def laguerre_coefficients(p, l_abs):
+    # generalized Laguerre polynomial L_p^|l| as np.polyval coefficients, highest power first
+    return np.asarray(genlaguerre(p, l_abs).coeffs, dtype=np.float64)
+
+
+@lru_cache(maxsize=None)
+def mode_norm(p, l_abs):
+    return np.sqrt(2 * math.factorial(p) / (np.pi * math.factorial(p + l_abs)))
+
+
+def cartesian_grid(x, y):
+    # rho, phi of a cartesian transverse grid, indexing='ij'
+    X, Y = np.meshgrid(x, y, indexing='ij')
+    return np.hypot(X, Y), np.arctan2(Y, X)
+
+
+def mode_slab(modes, rho, phi, z, z_r=1, w_0=1, k=2 * np.pi):
+    # complex field sum_n c_n LG_{p_n l_n}(rho, phi, z) * exp(ikz) for the z planes z, shape (len(z),) + rho.shape
+    # modes: iterable of (p, l, c); rho/phi: transverse grid shared by all planes
+    # all z dependent quantities are evaluated once per plane, not per voxel
+    z = np.asarray(z, dtype=np.float64).reshape(-1, 1, 1)
+    rho = np.asarray(rho, dtype=np.float64)[None]
+    phi = np.asarray(phi, dtype=np.float64)[None]
+    w = spot_radius(z, z_r, w_0)
+    # 1 / R(z) without the division by zero at the waist
+    inverse_radius = z / (z_r**2 + z**2)
+    gouy = np.arctan(z / z_r)
+    r = np.sqrt(2) * rho / w
+    x = r**2
+    envelope = (w_0 / w) * np.exp(-rho**2 / w**2 - 1j * k * rho**2 * inverse_radius / 2 + 1j * k * z)
+    field = np.zeros(np.broadcast_shapes(z.shape, rho.shape), dtype=np.complex128)
+    for p, l, c in modes:
+        l_abs = abs(l)
+        radial = mode_norm(p, l_abs) * r**l_abs * np.polyval(laguerre_coefficients(p, l_abs), x)
+        field += c * radial * np.exp(1j * l * phi - 1j * (2*p + l_abs + 1) * gouy)
+    return field * envelope
+
+
+def iter_slabs(modes, rho, phi, z, z_r=1, w_0=1, k=2 * np.pi, slab_size=SLAB_SIZE, workers=None):
+    # yields (z_slab, field_slab) in z order, evaluated lazily so only a few slabs are alive at a time
+    # workers > 1 evaluates up to 2 * workers slabs ahead on a thread pool
+    z = np.asarray(z, dtype=np.float64)
+    slabs = (z[start:start + slab_size] for start in range(0, len(z), slab_size))
+    if not workers or workers < 2:
+        for z_slab in slabs:
+            yield z_slab, mode_slab(modes, rho, phi, z_slab, z_r, w_0, k)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for z_slab in slabs:
+            pending.append((z_slab, pool.submit(mode_slab, modes, rho, phi, z_slab, z_r, w_0, k)))
+            if len(pending) >= 2 * workers:
+                z_done, future = pending.popleft()
+                yield z_done, future.result()
+        while pending:
+            z_done, future = pending.popleft()
+            yield z_done, future.result()
+
+
+def evaluate_volume(modes, rho, phi, z, z_r=1, w_0=1, k=2 * np.pi, quantity='intensity', dtype=np.float32,
+                    slab_size=SLAB_SIZE, workers=None):
+    # intensity |E|^2, phase arg(E) or the complex field over the volume, shape (len(z),) + rho.shape
+    if quantity == 'field':
+        dtype = np.complex64 if np.dtype(dtype).itemsize <= 4 else np.complex128
+    out = np.empty((len(z),) + np.shape(rho), dtype=dtype)
+    start = 0
+    for z_slab, field in iter_slabs(modes, rho, phi, z, z_r, w_0, k, slab_size, workers):
+        if quantity == 'intensity':
+            field = np.abs(field)**2
+        elif quantity == 'phase':
+            field = np.angle(field)
+        elif quantity != 'field':
+            raise ValueError(f"unknown quantity {quantity!r}, use 'intensity', 'phase' or 'field'")
+        out[start:start + len(z_slab)] = field
+        start += len(z_slab)
+    return out
+
+
+def volume_figure(X, Y, z, values, kind='isosurface', title='Laguerre-Gauss Intensity', **kwargs):
+    # isosurface/volume rendering of values (len(z),) + X.shape on the transverse grid X, Y
+    Zg = np.broadcast_to(np.asarray(z, dtype=np.float32)[:, None, None], values.shape)
+    Xg = np.broadcast_to(np.asarray(X, dtype=np.float32)[None], values.shape)
+    Yg = np.broadcast_to(np.asarray(Y, dtype=np.float32)[None], values.shape)
+    trace = go.Isosurface if kind == 'isosurface' else go.Volume
+    kwargs.setdefault('colorscale', 'RdBu' if kind != 'isosurface' else 'Viridis')
+    if kind == 'isosurface':
+        kwargs.setdefault('surface_count', 4)
+        kwargs.setdefault('caps', dict(x_show=False, y_show=False, z_show=False))
+    else:
+        kwargs.setdefault('opacity', 0.1)
+        kwargs.setdefault('surface_count', 15)
+    fig = go.Figure(trace(
+        x=Xg.ravel(), y=Yg.ravel(), z=Zg.ravel(), value=values.ravel(),
+        isomin=kwargs.pop('isomin', float(values.max()) * 0.1),
+        isomax=kwargs.pop('isomax', float(values.max())),
+        **kwargs
+    ))
+    fig.update_layout(
+        title=title,
+        scene=dict(xaxis_title='X', yaxis_title='Y', zaxis_title='Z'),
+        margin=dict(l=0, r=0, b=0, t=30)
+    )
+    return fig
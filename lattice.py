@@ -1,11 +1,348 @@
+import copy
+import itertools
 import numpy as np
 import plotly.graph_objects as go
-from dash import Dash, dcc, html, Output, Input
+from dash import Dash, dcc, html, Output, Input, State, Patch
 import dash
+from figure_encoding import encode_array, encode_figure
+from neighbors import NeighborIndex
+from lattice_lod import LevelOfDetail, DEFAULT_MAX_POINTS
+import metrics
+from figure_cache import FigureCache, params_key
+import lattice_cache
+import structures
+import bonds as bond_network
+from jobs import build_session as build_session_job, DONE as JOB_DONE, ERROR as JOB_ERROR, \
+    CANCELLED as JOB_CANCELLED
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+BOX_TOLERANCE = 1e-9
+# structure of a new visualizer session, see structures.preset; the box half width is bounded per session
+DEFAULT_SESSION = {'structure': 'fcc', 'size': 2.0, 'a': 1.0}
+MIN_SESSION_SIZE = 0.1
+MAX_SESSION_SIZE = 8.0
+# milliseconds between two progress polls of a background job
+JOB_POLL_INTERVAL = 250
+
+
+def _grid_shape(cell_ranges, n_basis):
+    # cell_ranges: ((lower_nx, upper_nx), (lower_ny, upper_ny), (lower_nz, upper_nz)), bounds inclusive
+    return tuple(int(upper) - int(lower) + 1 for lower, upper in cell_ranges) + (n_basis,)
+
+
+def box_cell_ranges(basis_vectors, atomic_basis, box):
+    # smallest inclusive (i, j, k) ranges whose points i*a1 + j*a2 + k*a3 + b_l can fall inside box
+    # r = n @ basis_vectors + b  ->  n = (r - b) @ inv(basis_vectors); the box maps to a parallelepiped,
+    # so its extremes are reached at the box corners
+    basis_vectors = np.asarray(basis_vectors, dtype=np.float64)
+    atomic_basis = np.asarray(atomic_basis, dtype=np.float64).reshape(-1, 3)
+    corners = np.array(list(itertools.product(*box)), dtype=np.float64)
+    n = ((corners[:, None, :] - atomic_basis[None, :, :]).reshape(-1, 3)) @ np.linalg.inv(basis_vectors)
+    lower = np.ceil(n.min(axis=0) - BOX_TOLERANCE).astype(int)
+    upper = np.floor(n.max(axis=0) + BOX_TOLERANCE).astype(int)
+    return tuple((int(lo), int(up)) for lo, up in zip(lower, upper))
+
+
+def box_mask(points, box):
+    # True for rows of points inside the (closed) box
+    lower = np.array([lo for lo, _ in box], dtype=np.float64)
+    upper = np.array([up for _, up in box], dtype=np.float64)
+    tol = BOX_TOLERANCE * max(1.0, float(np.max(np.abs(np.concatenate((lower, upper))))))
+    return np.all((points >= lower - tol) & (points <= upper + tol), axis=1)
+
+
+def box_difference(outer, inner):
+    # closed slabs covering outer minus inner (inner inside outer): the parts below/above inner along x,
+    # then along y within inner's x range, then along z within inner's x and y range
+    slabs = []
+    core = [tuple(bounds) for bounds in outer]
+    for d, ((lo, hi), (inner_lo, inner_hi)) in enumerate(zip(outer, inner)):
+        for bounds in ((lo, inner_lo), (inner_hi, hi)):
+            if bounds[1] > bounds[0]:
+                slabs.append(tuple(core[:d]) + (bounds,) + tuple(core[d + 1:]))
+        core[d] = (inner_lo, inner_hi)
+    return slabs
+
+
+def _reserve(buffer, used, needed):
+    # buffer with room for needed rows, grown geometrically so that repeated appends stay amortized O(appended)
+    if len(buffer) >= needed:
+        return buffer
+    grown = np.empty((max(needed, 2 * len(buffer)),) + buffer.shape[1:], dtype=buffer.dtype)
+    grown[:used] = buffer[:used]
+    return grown
+
+
+def lattice_points(basis_vectors, atomic_basis, cell_ranges, dtype=np.float64):
+    # all points i*a1 + j*a2 + k*a3 + b_l as one (N, 3) array, ordered like the loops i, j, k, l
+    basis_vectors = np.asarray(basis_vectors, dtype=np.float64)
+    atomic_basis = np.asarray(atomic_basis, dtype=np.float64).reshape(-1, 3)
+    (lx, ux), (ly, uy), (lz, uz) = cell_ranges
+    ni = np.arange(lx, ux + 1)[:, None, None, None, None] * basis_vectors[0]
+    nj = np.arange(ly, uy + 1)[None, :, None, None, None] * basis_vectors[1]
+    nk = np.arange(lz, uz + 1)[None, None, :, None, None] * basis_vectors[2]
+    points = (ni + nj) + nk + atomic_basis[None, None, None, :, :]
+    return points.reshape(-1, 3).astype(dtype, copy=False)
+
+
+def lattice_point_chunks(basis_vectors, atomic_basis, cell_ranges, chunk_size=DEFAULT_CHUNK_SIZE, dtype=np.float64):
+    # same order as lattice_points, but yields blocks of at most chunk_size rows
+    basis_vectors = np.asarray(basis_vectors, dtype=np.float64)
+    atomic_basis = np.asarray(atomic_basis, dtype=np.float64).reshape(-1, 3)
+    shape = _grid_shape(cell_ranges, len(atomic_basis))
+    lower = np.array([lower for lower, _ in cell_ranges])
+    total = int(np.prod(shape))
+    for start in range(0, total, chunk_size):
+        i, j, k, l = np.unravel_index(np.arange(start, min(start + chunk_size, total)), shape)
+        cells = np.stack((i, j, k), axis=1) + lower
+        yield (cells @ basis_vectors + atomic_basis[l]).astype(dtype, copy=False)
+
+
+def _box_rows(basis_vectors, atomic_basis, box, cell_ranges):
+    # for every (i, j) of cell_ranges: the k interval [k_lo, k_hi] whose points can lie inside box
+    (lx, ux), (ly, uy), (lz, uz) = cell_ranges
+    i, j = np.meshgrid(np.arange(lx, ux + 1), np.arange(ly, uy + 1), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    offsets = (i[:, None] * basis_vectors[0] + j[:, None] * basis_vectors[1])[:, None, :] + atomic_basis[None, :, :]
+    a3 = basis_vectors[2]
+    k_lo = np.full(offsets.shape[:2], float(lz))
+    k_hi = np.full(offsets.shape[:2], float(uz))
+    for d, (lower, upper) in enumerate(box):
+        if abs(a3[d]) > BOX_TOLERANCE:
+            t0 = (lower - offsets[..., d]) / a3[d]
+            t1 = (upper - offsets[..., d]) / a3[d]
+            k_lo = np.maximum(k_lo, np.minimum(t0, t1))
+            k_hi = np.minimum(k_hi, np.maximum(t0, t1))
+        else:
+            outside = (offsets[..., d] < lower - BOX_TOLERANCE) | (offsets[..., d] > upper + BOX_TOLERANCE)
+            k_hi[outside] = -np.inf
+    k_lo = np.ceil(k_lo - BOX_TOLERANCE)
+    k_hi = np.floor(k_hi + BOX_TOLERANCE)
+    # union over the basis atoms, empty intervals do not count
+    empty = k_lo > k_hi
+    k_lo = np.where(empty, np.inf, k_lo).min(axis=1)
+    k_hi = np.where(empty, -np.inf, k_hi).max(axis=1)
+    counts = np.where(k_hi >= k_lo, k_hi - k_lo + 1, 0).astype(np.int64)
+    k_lo = np.where(counts > 0, k_lo, 0).astype(np.int64)
+    return i, j, k_lo, counts
+
+
+def box_index_chunks(basis_vectors, atomic_basis, box, chunk_size=DEFAULT_CHUNK_SIZE, dtype=np.float64, stats=None):
+    # (cells, basis_index, points) of the atoms inside box, ordered like the loops i, j, k, l,
+    # in blocks of at most chunk_size candidates
+    # only cells of the tight per-row k intervals are generated; the rest is cropped with box_mask
+    # stats (a dict) receives the running 'generated' and 'kept' counters and the total 'candidates'
+    basis_vectors = np.asarray(basis_vectors, dtype=np.float64)
+    atomic_basis = np.asarray(atomic_basis, dtype=np.float64).reshape(-1, 3)
+    n_basis = len(atomic_basis)
+    cell_ranges = box_cell_ranges(basis_vectors, atomic_basis, box)
+    if any(lower > upper for lower, upper in cell_ranges):
+        return
+    i, j, k_lo, counts = _box_rows(basis_vectors, atomic_basis, box, cell_ranges)
+    row_start = np.concatenate(([0], np.cumsum(counts)))
+    total = int(row_start[-1]) * n_basis
+    if stats is not None:
+        stats['candidates'] = stats.get('candidates', 0) + total
+    for start in range(0, total, chunk_size):
+        flat = np.arange(start, min(start + chunk_size, total))
+        cell, l = np.divmod(flat, n_basis)
+        row = np.searchsorted(row_start, cell, side='right') - 1
+        cells = np.stack((i[row], j[row], k_lo[row] + cell - row_start[row]), axis=1)
+        points = (cells @ basis_vectors + atomic_basis[l]).astype(dtype, copy=False)
+        mask = box_mask(points, box)
+        if stats is not None:
+            stats['generated'] = stats.get('generated', 0) + len(points)
+            stats['kept'] = stats.get('kept', 0) + int(np.count_nonzero(mask))
+        yield cells[mask], l[mask], points[mask]
+
+
+def box_point_chunks(basis_vectors, atomic_basis, box, chunk_size=DEFAULT_CHUNK_SIZE, dtype=np.float64, stats=None):
+    # points inside box, see box_index_chunks
+    for _, _, points in box_index_chunks(basis_vectors, atomic_basis, box, chunk_size, dtype, stats):
+        yield points
+
+
+class CountableLattice:
+    # compact integer storage of a lattice: one record per atom holding its cell (i, j, k) and basis index l
+    # cartesian positions are computed on demand, and cached per dtype unless asked not to
+    # records can be appended, rows never move, so indices stay valid while the lattice grows
+
+    def __init__(self, basis_vectors, atomic_basis, records):
+        self.basis_vectors = np.asarray(basis_vectors, dtype=np.float64)
+        self.atomic_basis = np.asarray(atomic_basis, dtype=np.float64).reshape(-1, 3)
+        self._buffer = records
+        self.records = records
+        # dtype -> (position buffer, rows filled)
+        self._positions = {}
+        self._row_table = None
+
+    @staticmethod
+    def record_dtype(cell_ranges, n_basis):
+        if n_basis > np.iinfo(np.uint8).max + 1:
+            raise ValueError(f"at most 256 basis atoms can be indexed, got {n_basis}")
+        int16 = np.iinfo(np.int16)
+        fits = all(int16.min <= lower and upper <= int16.max for lower, upper in cell_ranges)
+        return np.dtype([('cell', np.int16 if fits else np.int32, (3,)), ('basis', np.uint8)])
+
+    @classmethod
+    def from_box(cls, basis_vectors, atomic_basis, box, chunk_size=DEFAULT_CHUNK_SIZE, stats=None, progress=None):
+        # progress(done, total) is called after every chunk of candidates
+        atomic_basis = np.asarray(atomic_basis, dtype=np.float64).reshape(-1, 3)
+        dtype = cls.record_dtype(box_cell_ranges(basis_vectors, atomic_basis, box), len(atomic_basis))
+        stats = {} if stats is None and progress is not None else stats
+        blocks = []
+        for cells, l, _ in box_index_chunks(basis_vectors, atomic_basis, box, chunk_size, stats=stats):
+            block = np.empty(len(l), dtype=dtype)
+            block['cell'] = cells
+            block['basis'] = l
+            blocks.append(block)
+            if progress is not None:
+                progress(stats['generated'], stats['candidates'])
+        return cls(basis_vectors, atomic_basis, np.concatenate(blocks) if blocks else np.empty(0, dtype=dtype))
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def cells(self):
+        return self.records['cell']
+
+    @property
+    def basis_index(self):
+        return self.records['basis']
+
+    @property
+    def nbytes(self):
+        return self.records.nbytes
+
+    def positions(self, dtype=np.float64, chunk_size=DEFAULT_CHUNK_SIZE, cache=True):
+        # only rows appended since the last call are computed; cache=False returns a fresh array and keeps
+        # nothing, unless positions of dtype are already cached
+        dtype = np.dtype(dtype)
+        n = len(self.records)
+        if not cache and dtype not in self._positions:
+            out = np.empty((n, 3), dtype=dtype)
+            for start, points in self.position_blocks(chunk_size, dtype):
+                out[start:start + len(points)] = points
+            return out
+        out, filled = self._positions.get(dtype, (np.empty((0, 3), dtype=dtype), 0))
+        if filled < n:
+            out = _reserve(out, filled, n)
+            for start in range(filled, n, chunk_size):
+                block = self.records[start:min(start + chunk_size, n)]
+                out[start:start + len(block)] = block['cell'] @ self.basis_vectors + self.atomic_basis[block['basis']]
+            self._positions[dtype] = (out, n)
+        return out[:n]
+
+    def positions_of(self, rows, dtype=np.float64):
+        # positions of the given rows only, from the cache if it covers them
+        dtype = np.dtype(dtype)
+        cached, filled = self._positions.get(dtype, (None, 0))
+        if filled == len(self.records) and cached is not None:
+            return cached[rows]
+        block = self.records[rows]
+        return (block['cell'] @ self.basis_vectors + self.atomic_basis[block['basis']]).astype(dtype, copy=False)
+
+    def position_blocks(self, chunk_size=DEFAULT_CHUNK_SIZE, dtype=np.float64):
+        # (first row, positions) per block of at most chunk_size records, nothing is cached
+        for start in range(0, len(self.records), chunk_size):
+            block = self.records[start:start + chunk_size]
+            yield start, (block['cell'] @ self.basis_vectors + self.atomic_basis[block['basis']]).astype(dtype, copy=False)
+
+    def inside(self, box, chunk_size=DEFAULT_CHUNK_SIZE):
+        # mask of the records inside box, evaluated block by block
+        mask = np.empty(len(self.records), dtype=bool)
+        for start, points in self.position_blocks(chunk_size):
+            mask[start:start + len(points)] = box_mask(points, box)
+        return mask
+
+    def __getstate__(self):
+        # pickles (e.g. figure_cache's disk tier) carry the records only, the caches are rebuilt on demand
+        state = self.__dict__.copy()
+        state['_buffer'] = state['records']
+        state['_positions'] = {}
+        state['_row_table'] = None
+        return state
+
+    def append(self, cells, basis_index):
+        # append atoms, returns their rows; cached positions are extended lazily on the next positions() call
+        n, m = len(self.records), len(cells)
+        if m == 0:
+            return np.arange(n, n, dtype=np.int64)
+        cells = np.asarray(cells)
+        int16 = np.iinfo(np.int16)
+        if self.records.dtype['cell'].base == np.int16 and (cells.min() < int16.min or cells.max() > int16.max):
+            # cells outside the int16 range, widen the storage once
+            self._buffer = self._buffer.astype(np.dtype([('cell', np.int32, (3,)), ('basis', np.uint8)]))
+        self._buffer = _reserve(self._buffer, n, n + m)
+        self._buffer[n:n + m]['cell'] = cells
+        self._buffer[n:n + m]['basis'] = basis_index
+        self.records = self._buffer[:n + m]
+        self._row_table = None
+        return np.arange(n, n + m, dtype=np.int64)
+
+    def copy(self):
+        other = CountableLattice(self.basis_vectors, self.atomic_basis, self.records.copy())
+        other._positions = {dtype: (positions[:filled].copy(), filled)
+                            for dtype, (positions, filled) in self._positions.items()}
+        return other
+
+    def clear_cache(self):
+        # drop cached positions and the lookup table, only the integer records stay resident
+        self._positions.clear()
+        self._row_table = None
+
+    def _pack(self, cells, basis_index, lower, shape):
+        # one integer per atom: (i, j, k) relative to the lower cell corner and l in row major order
+        i, j, k = (cells[:, d].astype(np.int64) - lower[d] for d in range(3))
+        return ((i * shape[1] + j) * shape[2] + k) * len(self.atomic_basis) + basis_index
+
+    def _table(self):
+        # (lower cell, cell shape, sorted packed keys, rows in key order) of the (i, j, k, l) -> row lookup,
+        # about 8 bytes per atom (int32 keys and rows) instead of a dense table over the bounding cell box
+        if self._row_table is None:
+            cells = self.cells
+            lower = cells.min(axis=0).astype(np.int64) if len(cells) else np.zeros(3, dtype=np.int64)
+            shape = cells.max(axis=0).astype(np.int64) - lower + 1 if len(cells) else np.zeros(3, dtype=np.int64)
+            keys = self._pack(cells, self.basis_index, lower, shape)
+            order = np.argsort(keys, kind='stable')
+            int32 = np.iinfo(np.int32).max
+            keys = keys[order].astype(np.int32 if np.prod(shape) * len(self.atomic_basis) <= int32 else np.int64)
+            self._row_table = (lower, shape, keys, order.astype(np.int32 if len(order) <= int32 else np.int64))
+        return self._row_table
+
+    def rows(self, cells, basis_index):
+        # vectorized lookup of the rows of atoms (cells[n], basis_index[n]), -1 for atoms not stored
+        lower, shape, keys, order = self._table()
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1, 3)
+        basis_index = np.broadcast_to(np.asarray(basis_index, dtype=np.int64), cells.shape[:1])
+        inside = np.all((cells >= lower) & (cells < lower + shape), axis=1) & (basis_index >= 0) & \
+            (basis_index < len(self.atomic_basis))
+        packed = self._pack(cells[inside], basis_index[inside], lower, shape)
+        found = np.minimum(np.searchsorted(keys, packed), max(len(keys) - 1, 0))
+        hit = keys[found] == packed if len(keys) else np.zeros(len(packed), dtype=bool)
+        rows = np.full(len(cells), -1, dtype=np.int64)
+        rows[np.flatnonzero(inside)[hit]] = order[found[hit]]
+        return rows
+
+    def row(self, i, j, k, l):
+        return int(self.rows([(i, j, k)], [l])[0])
+
+    def __getitem__(self, key):
+        # countable_lattice[i, j, k, l] -> cartesian position of that atom
+        row = self.row(*key)
+        if row < 0:
+            raise KeyError(key)
+        return self.records[row]['cell'] @ self.basis_vectors + self.atomic_basis[self.records[row]['basis']]
+
 
 class lattice:
 
-    def __init__(self, range_x: np.array, range_y: np.array, range_z: np.array, a_x: float, a_y: float, a_z: float, atomic_basis: np.array, basis_vec_x: np.array, basis_vec_y: np.array, basis_vec_z: np.array,  structure_type: str):
+    def __init__(self, range_x: np.array, range_y: np.array, range_z: np.array, a_x: float, a_y: float, a_z: float, atomic_basis: np.array, basis_vec_x: np.array, basis_vec_y: np.array, basis_vec_z: np.array,  structure_type: str, position_dtype=np.float64, progress=None, cache=None, cache_positions=True):
+        # cache: lattice_cache.LatticeCache the generated atoms are loaded from and stored in,
+        # None for lattice_cache.default, False for none
+        # cache_positions: keep metric_lattice once computed (24 bytes per atom in float64 on top of the 7 byte
+        # records); False recomputes it from the records on every access instead, for lattices too large for both
         self.range_x = range_x
         self.range_y = range_y
         self.range_z = range_z
@@ -18,91 +355,247 @@ class lattice:
         self.basis_vec_y = basis_vec_y
         self.basis_vec_z = basis_vec_z
         self.basis_vectors = np.array([self.basis_vec_x, self.basis_vec_y, self.basis_vec_z])
+        self.position_dtype = position_dtype
+        self.cache_positions = cache_positions
 
         # construct
-        #self.countable_lattice = np.zeros((int(self.length_x/self.a_x), int(self.length_y/self.a_y), int(self.length_z/self.a_z), len(self.atomic_basis)))
-        self.metric_lattice = []
-        self.lower_nx = int(self.range_x[0]/self.a_x)
-        self.upper_nx = int(self.range_x[1]/self.a_x)
-        self.lower_ny = int(self.range_y[0]/self.a_y)
-        self.upper_ny = int(self.range_y[1]/self.a_y)
-        self.lower_nz = int(self.range_z[0]/self.a_z)
-        self.upper_nz = int(self.range_z[1]/self.a_z)
-        for i in range(self.lower_nx, self.upper_nx+1):
-            for j in range(self.lower_ny, self.upper_ny+1):
-                for k in range(self.lower_nz, self.upper_nz+1):
-                    for l in range(len(self.atomic_basis)):
-                        #self.countable_lattice[i][j][k][l] = 1
-                        self.metric_lattice.append(i*self.basis_vec_x + j*self.basis_vec_y + k*self.basis_vec_z + l*self.atomic_basis[l]) 
-        self.metric_lattice = np.array(self.metric_lattice)
+        (self.lower_nx, self.upper_nx), (self.lower_ny, self.upper_ny), (self.lower_nz, self.upper_nz) = \
+            box_cell_ranges(self.basis_vectors, self.atomic_basis, self.box())
+        cache = lattice_cache.default if cache is None else cache
+        cached = None
+        if cache:
+            key = lattice_cache.lattice_key(self.basis_vectors, self.atomic_basis, self.box(), position_dtype)
+            cached = cache.get(key)
+        if cached is not None:
+            # memory mapped records and positions, shared with every other process that opened the entry
+            records, positions, stats = cached
+            self.countable_lattice = CountableLattice(self.basis_vectors, self.atomic_basis, records)
+            self.countable_lattice._positions[np.dtype(position_dtype)] = (positions, len(positions))
+            if progress is not None:
+                progress(stats.get('candidates', 1), stats.get('candidates', 1))
+        else:
+            # per-build counters: points generated from the cell ranges vs. points kept inside the box
+            stats = {}
+            with metrics.timer('lattice.generate'):
+                self.countable_lattice = CountableLattice.from_box(self.basis_vectors, self.atomic_basis, self.box(),
+                                                                   stats=stats, progress=progress)
+            if cache:
+                cache.put(key, self.countable_lattice.records,
+                          self.countable_lattice.positions(position_dtype, cache=False), stats)
+        self.n_generated = stats.get('generated', 0)
+        self.n_kept = stats.get('kept', 0)
+        metrics.observe('lattice.points', self.n_kept)
+        # countable_lattice holds every atom of stored_box, mask marks the ones inside the current box
+        # (None: all of them), see resize
+        self.stored_box = self.box()
+        self.mask = None
+        # derived structures, valid until the lattice changes
+        self._neighbor_indices = {}
+        self._visible_positions = None
+        # shell radii of the infinite crystal, independent of the box
+        self._shell_radii = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_neighbor_indices'] = {}
+        state['_visible_positions'] = None
+        return state
+
+    @property
+    def metric_lattice(self):
+        # positions of the atoms in the box, computed lazily and kept unless cache_positions is off
+        # (positions memory mapped from a lattice_cache are always used)
+        if self._visible_positions is not None:
+            return self._visible_positions
+        if self.mask is None:
+            return self.countable_lattice.positions(self.position_dtype, cache=self.cache_positions)
+        positions = self.countable_lattice.positions_of(self.visible_rows(), self.position_dtype)
+        if self.cache_positions:
+            self._visible_positions = positions
+        return positions
+
+    def points(self, rows=None):
+        # metric_lattice[rows], computing only those rows
+        if rows is None:
+            return self.metric_lattice
+        if self._visible_positions is not None:
+            return self._visible_positions[rows]
+        return self.countable_lattice.positions_of(self.visible_rows()[rows], self.position_dtype)
+
+    def visible_rows(self):
+        # countable_lattice rows of the atoms in the current box, in metric_lattice order
+        return np.arange(len(self.countable_lattice)) if self.mask is None else np.flatnonzero(self.mask)
+
+    def resize(self, range_x, range_y, range_z, chunk_size=DEFAULT_CHUNK_SIZE):
+        # change the box in place; only the slabs of the new box outside stored_box are generated and appended,
+        # so existing rows keep their index; shrinking (or growing back inside stored_box) only updates mask
+        # returns the countable_lattice rows of the newly generated atoms
+        box = tuple((float(lo), float(hi)) for lo, hi in (range_x, range_y, range_z))
+        grown = tuple((min(lo, s_lo), max(hi, s_hi)) for (lo, hi), (s_lo, s_hi) in zip(box, self.stored_box))
+        added = np.empty(0, dtype=np.int64)
+        if grown != self.stored_box:
+            stats = {}
+            covered = [self.stored_box]
+            with metrics.timer('lattice.grow'):
+                for slab in box_difference(grown, self.stored_box):
+                    for cells, l, points in box_index_chunks(self.basis_vectors, self.atomic_basis, slab, chunk_size,
+                                                             stats=stats):
+                        # atoms on a face shared with the stored region or an earlier slab are already there
+                        new = ~np.any([box_mask(points, done) for done in covered], axis=0)
+                        added = np.concatenate((added, self.countable_lattice.append(cells[new], l[new])))
+                    covered.append(slab)
+            self.n_generated += stats.get('generated', 0)
+            self.n_kept += len(added)
+            self.stored_box = grown
+        self.range_x, self.range_y, self.range_z = [list(bounds) for bounds in box]
+        (self.lower_nx, self.upper_nx), (self.lower_ny, self.upper_ny), (self.lower_nz, self.upper_nz) = \
+            box_cell_ranges(self.basis_vectors, self.atomic_basis, box)
+        if box == self.stored_box:
+            self.mask = None
+        else:
+            self.mask = self.countable_lattice.inside(box, chunk_size)
+        self._neighbor_indices = {}
+        self._visible_positions = None
+        return added
 
+    def grown_rows(self, base):
+        # countable_lattice rows visible here but not in base, the lattice this one was copied from and resized
+        n, m = len(base.countable_lattice), len(self.countable_lattice)
+        if self.mask is None and base.mask is None:
+            return np.arange(n, m, dtype=np.int64)
+        visible = np.ones(m, dtype=bool) if self.mask is None else self.mask.copy()
+        visible[:n] &= False if base.mask is None else ~base.mask
+        return np.flatnonzero(visible)
+
+    def copy(self):
+        # independent lattice with its own storage, e.g. to resize a lattice that is shared through a cache
+        other = copy.copy(self)
+        other.countable_lattice = self.countable_lattice.copy()
+        other.mask = None if self.mask is None else self.mask.copy()
+        other._neighbor_indices = {}
+        other._visible_positions = None
+        return other
+
+    def box(self):
+        return (tuple(self.range_x), tuple(self.range_y), tuple(self.range_z))
+
+    def cell_ranges(self):
+        return ((self.lower_nx, self.upper_nx), (self.lower_ny, self.upper_ny), (self.lower_nz, self.upper_nz))
+
+    def neighbor_index(self, period=None):
+        # cached neighbors.NeighborIndex over metric_lattice, period (Lx, Ly, Lz) makes it periodic from the box corner;
+        # atoms on the upper faces are then images of the lower ones and left out, index.rows maps back
+        key = None if period is None else tuple(float(p) for p in period)
+        if key not in self._neighbor_indices:
+            origin = [lower for lower, _ in self.box()]
+            self._neighbor_indices[key] = NeighborIndex(self.metric_lattice, period, origin)
+        return self._neighbor_indices[key]
+
+    def shell_radius(self, shell=1):
+        # radius of the shell-th coordination shell of the crystal (None if there is none), from a small cluster
+        # around the box centre, so it costs the same for any box size
+        if shell not in self._shell_radii:
+            half = (shell + 2) * np.linalg.norm(self.basis_vectors, axis=1).max()
+            box = [(centre - half, centre + half) for centre in np.mean(self.box(), axis=1)]
+            cluster = np.concatenate(list(box_point_chunks(self.basis_vectors, self.atomic_basis, box)))
+            radii = NeighborIndex(cluster).shell_radii(shell)
+            self._shell_radii[shell] = float(radii[shell - 1]) if len(radii) >= shell else None
+        return self._shell_radii[shell]
+
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE, dtype=np.float64):
+        # points inside the box, generated in blocks of at most chunk_size candidates
+        return box_point_chunks(self.basis_vectors, self.atomic_basis, self.box(), chunk_size, dtype)
+
+    def bonds(self, bonds='nearest', rows=None, points=None):
+        # (i, j, distances) of the bonded pairs of metric_lattice (of metric_lattice[rows] if given), see bonds_trace
+        # points: self.points(rows) if the caller already has them; a neighbor_index() built before is reused,
+        # otherwise the search index is not kept
+        points = self.points(rows) if points is None else points
+        options = _bond_options(bonds)
+        if rows is not None and 'shell' in options:
+            # the nearest distances within a thinned out subset (e.g. a level of detail) are not the crystal's,
+            # its shell radius is used as the cutoff instead
+            options = {'cutoff': self.shell_radius(options['shell'])}
+            if options['cutoff'] is None:
+                empty = np.empty(0, dtype=np.int64)
+                return empty, empty, np.empty(0)
+        index = self._neighbor_indices.get(None) if rows is None else None
+        return bond_network.find_bonds(points, index=index, **options)
+
+    def bonds_trace(self, bonds='nearest', rows=None, visible=True, points=None):
+        # every bond as one line trace, bonds: 'nearest' for the nearest neighbour shell or a cutoff distance
+        points = self.points(rows) if points is None else points
+        i, j, _ = self.bonds(bonds, rows, points)
+        metrics.observe('lattice.bonds', len(i))
+        return bond_network.bond_trace(points, i, j, uid='bonds', meta='bonds', visible=visible)
+
+    @metrics.timed('lattice.get_figure')
     def get_figure(self, show_lattice=True, show_basis=True, show_unit_cell=True,
-                camera=None, x_range=None, y_range=None, z_range=None):
+                camera=None, x_range=None, y_range=None, z_range=None, rows=None, binary=False,
+                bonds=None, show_bonds=True):
+        # rows: optional subset of metric_lattice to draw, e.g. from lattice_lod.LevelOfDetail
+        # binary: return a figure dict with float32 typed arrays instead of a go.Figure (see figure_encoding)
+        # bonds: None for no bond trace, else 'nearest' or a cutoff distance (see bonds_trace)
         fig = go.Figure()
+        points = self.points(rows)
 
-        if show_lattice:
-            fig.add_trace(go.Scatter3d(
-                x=self.metric_lattice[:, 0],
-                y=self.metric_lattice[:, 1],
-                z=self.metric_lattice[:, 2],
-                mode='markers',
-                marker=dict(size=5, color='blue', opacity=0.8),
-                name='Lattice Points'
-            ))
+        # every trace group is always present and only toggled through 'visible', so a Dash callback can
+        # flip groups with a partial update; uid/meta identify the traces independent of their position
+        fig.add_trace(go.Scatter3d(
+            x=points[:, 0],
+            y=points[:, 1],
+            z=points[:, 2],
+            mode='markers',
+            marker=dict(size=5, color='blue', opacity=0.8),
+            name='Lattice Points',
+            uid='lattice-points',
+            meta='lattice',
+            visible=show_lattice
+        ))
 
         origin = np.array([0, 0, 0])
         colors = ['red', 'green', 'purple']
         labels = ['a1', 'a2', 'a3']
 
-        if show_basis:
-            for vec, color, label in zip(self.basis_vectors, colors, labels):
-                fig.add_trace(go.Scatter3d(
-                    x=[origin[0], vec[0]],
-                    y=[origin[1], vec[1]],
-                    z=[origin[2], vec[2]],
-                    mode='lines+text',
-                    line=dict(color=color, width=6),
-                    text=[None, label],
-                    textposition='top center',
-                    showlegend=False
-                ))
-
-                fig.add_trace(go.Cone(
-                    x=[vec[0]],
-                    y=[vec[1]],
-                    z=[vec[2]],
-                    u=[vec[0]],
-                    v=[vec[1]],
-                    w=[vec[2]],
-                    sizemode='absolute',
-                    sizeref=0.15,
-                    anchor='tip',
-                    colorscale=[[0, color], [1, color]],
-                    showscale=False,
-                    opacity=1.0
-                ))
-
-        if show_unit_cell:
-            unit_cell_corners = np.array([
-                [0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1],
-                [1, 1, 0], [1, 0, 1], [0, 1, 1], [1, 1, 1]
-            ])
-            edges = [
-                (0, 1), (0, 2), (0, 3),
-                (1, 4), (1, 5),
-                (2, 4), (2, 6),
-                (3, 5), (3, 6),
-                (4, 7), (5, 7), (6, 7)
-            ]
-            for start, end in edges:
-                fig.add_trace(go.Scatter3d(
-                    x=[unit_cell_corners[start][0], unit_cell_corners[end][0]],
-                    y=[unit_cell_corners[start][1], unit_cell_corners[end][1]],
-                    z=[unit_cell_corners[start][2], unit_cell_corners[end][2]],
-                    mode='lines',
-                    line=dict(color='black', width=3),
-                    showlegend=False
-                ))
+        for vec, color, label in zip(self.basis_vectors, colors, labels):
+            fig.add_trace(go.Scatter3d(
+                x=[origin[0], vec[0]],
+                y=[origin[1], vec[1]],
+                z=[origin[2], vec[2]],
+                mode='lines+text',
+                line=dict(color=color, width=6),
+                text=[None, label],
+                textposition='top center',
+                showlegend=False,
+                uid=f'basis-{label}-line',
+                meta='basis',
+                visible=show_basis
+            ))
+
+            fig.add_trace(go.Cone(
+                x=[vec[0]],
+                y=[vec[1]],
+                z=[vec[2]],
+                u=[vec[0]],
+                v=[vec[1]],
+                w=[vec[2]],
+                sizemode='absolute',
+                sizeref=0.15,
+                anchor='tip',
+                colorscale=[[0, color], [1, color]],
+                showscale=False,
+                opacity=1.0,
+                uid=f'basis-{label}-cone',
+                meta='basis',
+                visible=show_basis
+            ))
+
+        # all 12 edges of the unit cube in one trace
+        fig.add_trace(bond_network.cell_edge_trace(np.eye(3), uid='unit-cell-edges', meta='unit_cell',
+                                                   visible=show_unit_cell))
+
+        if bonds is not None:
+            fig.add_trace(self.bonds_trace(bonds, rows, visible=show_bonds, points=points))
 
         fig.update_layout(
             scene=dict(
@@ -111,75 +604,378 @@ class lattice:
                 zaxis=dict(title='Z', range=z_range or self.range_z),
                 camera=camera or dict(eye=dict(x=1.5, y=1.5, z=1.5)),
                 aspectmode='data',
+                uirevision='lattice',
             ),
+            # the browser keeps camera/zoom across figure updates as long as uirevision does not change
+            uirevision='lattice',
             margin=dict(l=0, r=0, b=0, t=30),
-            title="FCC Lattice"
+            title=f"{structure_title(self.structure_type)} Lattice"
         )
 
-        return fig
+        return encode_figure(fig) if binary else fig
+
+
+def structure_title(structure_type):
+    # display name of a structure_type, abbreviations like 'fcc' in upper case
+    return structure_type.upper() if len(structure_type) <= 3 else structure_type.capitalize()
+
+
+def _bond_options(bonds):
+    # keyword arguments of bonds.find_bonds for 'nearest' or a cutoff distance
+    if bonds == 'nearest':
+        return {'shell': 1}
+    return {'cutoff': float(bonds)}
+
+
+def trace_groups(fig):
+    # {group: [trace indices]} from the 'meta' tag get_figure puts on every trace
+    groups = {}
+    for index, trace in enumerate(fig['data'] if isinstance(fig, dict) else fig.data):
+        groups.setdefault(trace['meta'], []).append(index)
+    return groups
+
+
+def resized_figure(figure, lat, binary=False, bonds=None):
+    # figure of a resized lattice from its figure before: new lattice points, bonds and axis ranges,
+    # the rest is shared
+    points = lat.metric_lattice
+    groups = trace_groups(figure)
+    data = list(figure['data'])
+    index = groups['lattice'][0]
+    data[index] = dict(data[index], **{key: encode_array(points[:, d]) if binary else points[:, d]
+                                       for d, key in enumerate('xyz')})
+    if bonds is not None and 'bonds' in groups:
+        index = groups['bonds'][0]
+        trace = lat.bonds_trace(bonds, visible=data[index].get('visible', True), points=points).to_plotly_json()
+        data[index] = encode_figure({'data': [trace]})['data'][0] if binary else trace
+    layout = copy.deepcopy(figure['layout'])
+    for axis, bounds in zip(('xaxis', 'yaxis', 'zaxis'), lat.box()):
+        layout['scene'][axis]['range'] = list(bounds)
+    return dict(figure, data=data, layout=layout)
+
+
+def session_entry(lat, lod=False, max_points=DEFAULT_MAX_POINTS, binary=False, base_figure=None, bonds=None):
+    # ({'lattice', 'figure'}, LevelOfDetail or None) as LatticeVisualizer caches them; base_figure: figure of
+    # the same structure in another box, only its lattice points are replaced
+    level_of_detail = None
+    if lod:
+        level_of_detail = LevelOfDetail(lat.metric_lattice, max_points)
+        fig = lat.get_figure(rows=level_of_detail.select(), binary=binary, bonds=bonds)
+    elif base_figure is not None:
+        return {'lattice': lat, 'figure': resized_figure(base_figure, lat, binary, bonds)}, None
+    else:
+        fig = lat.get_figure(binary=binary, bonds=bonds)
+    return {'lattice': lat, 'figure': fig if binary else fig.to_plotly_json()}, level_of_detail
 
 
 class LatticeVisualizer:
-    def __init__(self, lattice):
+    def __init__(self, lattice=None, lod=False, max_points=DEFAULT_MAX_POINTS, binary=False, instrument=False,
+                 profile=False, cache=None, params=None, jobs=None, bonds=None):
+        # lattice: one fixed lattice shown to every user; without it each browser session picks its own structure,
+        # box size and lattice constant (held in a session dcc.Store) starting from params
+        # cache: figure_cache.FigureCache for the generated lattices and base figures, give it a disk_dir to share
+        # them between worker processes (a trusted one, its pickles are loaded)
+        # jobs: jobs.JobManager; sessions whose lattice is not cached are built there in the background
+        # with a progress display instead of inside the request
+        # lod: only send the points inside the current view, at most max_points, refined on zoom
+        # binary: ship point coordinates as base64 float32 typed arrays instead of JSON number lists
+        # bonds: draw bonds as one toggleable line trace, 'nearest' (neighbour shell) or a cutoff distance
+        # instrument: time callbacks and requests, record payload sizes and serve them on /metrics (only with
+        # $QTS_METRICS_TOKEN set, see metrics.Metrics.instrument),
+        # profile: additionally cProfile every Dash request (/metrics/profile)
         self.lattice = lattice
+        self.lod = lod
+        self.max_points = max_points
+        self.binary = binary
+        self.bonds = bonds
         self.app = Dash(__name__)
+        if instrument or profile or metrics.registry.enabled:
+            metrics.registry.enable(profile or None)
+            metrics.registry.instrument(self.app.server)
+        self.cache = cache if cache is not None else FigureCache()
+        self.jobs = jobs
+        self.params = self.clean_params(params or DEFAULT_SESSION)
+        self.figure = self.session(self.params)['figure']
+        # every figure has the same traces in the same order, so the groups hold for all sessions
+        self.trace_groups = trace_groups(self.figure)
         self.setup_layout()
         self.setup_callbacks()
 
+    @staticmethod
+    def clean_params(params):
+        params = dict(DEFAULT_SESSION, **params)
+        return {
+            'structure': params['structure'] if params['structure'] in structures.STRUCTURES else DEFAULT_SESSION['structure'],
+            'size': float(np.clip(params['size'], MIN_SESSION_SIZE, MAX_SESSION_SIZE)),
+            'a': float(max(params['a'], MIN_SESSION_SIZE)),
+        }
+
+    def key(self, params):
+        # a fixed lattice has a single entry per visualizer, it must not collide with other processes on disk
+        source = {'fixed': id(self)} if self.lattice is not None else self.clean_params(params)
+        return params_key(dict(source, lod=self.lod, max_points=self.max_points, binary=self.binary,
+                               bonds=self.bonds))
+
+    def session(self, params, base=None):
+        # {'lattice', 'figure'} for the session parameters, from the cache or built; when base (parameters of
+        # a cached session) differs only in the box size, its lattice is resized instead of rebuilt
+        def build():
+            if self.lattice is None and base is not None and self.key(base) in self.cache:
+                old, new = self.clean_params(base), self.clean_params(params)
+                if dict(old, size=new['size']) == new:
+                    return self.build_session(params, old)
+            return self.build_session(params)
+        return self.cache.get_or_build(self.key(params), build, disk=self.lattice is None)
+
+    def level_of_detail(self, params):
+        # process local, rebuilt from the cached lattice when missing
+        return self.cache.get_or_build(self.key(params) + '/lod', lambda: LevelOfDetail(
+            self.session(params)['lattice'].metric_lattice, self.max_points), disk=False)
+
+    def build_session(self, params, base=None):
+        # base: parameters of a cached session of the same structure, its lattice is resized
+        params = self.clean_params(params)
+        base_entry = self.session(base) if base is not None and self.lattice is None else None
+        if self.lattice is not None:
+            lat = self.lattice
+        elif base_entry is not None:
+            # only the shell between the two boxes is generated, the cached lattice itself stays untouched
+            lat = base_entry['lattice'].copy()
+            lat.resize(*[(-params['size'], params['size'])] * 3)
+        else:
+            lat = structures.build(params['structure'], params['size'], params['a'])
+        entry, lod = session_entry(lat, self.lod, self.max_points, self.binary,
+                                   base_entry['figure'] if base_entry is not None else None, self.bonds)
+        if base_entry is not None:
+            # rows shown on top of the base session, show() extends its graph by just these
+            entry['added'] = {'base': self.key(base), 'rows': lat.grown_rows(base_entry['lattice'])}
+        if lod is not None:
+            self.cache.put(self.key(params) + '/lod', lod, disk=False)
+        return entry
+
+    def show(self, params, shown, selected):
+        # (figure, extendData) taking the graph from the shown parameters to params: a larger box of the same
+        # structure only sends the added points (bonds change along the old surface, so not with bonds),
+        # anything else the cached base figure with the toggles applied
+        entry = self.session(params, base=shown)
+        if not self.lod and self.bonds is None and dict(shown, size=params['size']) == params and params['size'] > shown['size']:
+            lat = entry['lattice']
+            if entry.get('added', {}).get('base') == self.key(shown):
+                added = lat.countable_lattice.positions_of(entry['added']['rows'], lat.position_dtype)
+            else:
+                # built independently of the shown session (e.g. by a job), its rows are unrelated
+                points = lat.metric_lattice
+                added = points[~box_mask(points, [(-shown['size'], shown['size'])] * 3)]
+            metrics.observe('session.extend_points', len(added))
+            patch = Patch()
+            for axis in ('xaxis', 'yaxis', 'zaxis'):
+                patch['layout']['scene'][axis]['range'] = [-params['size'], params['size']]
+            return patch, [{key: [added[:, d]] for d, key in enumerate('xyz')}, self.trace_groups['lattice']]
+        figure = entry['figure']
+        figure = dict(figure, data=[dict(trace, visible=trace['meta'] in selected) for trace in figure['data']])
+        return figure, dash.no_update
+
+    def page_title(self, params):
+        structure = self.lattice.structure_type if self.lattice is not None else self.clean_params(params)['structure']
+        return f"{structure_title(structure)} Lattice Visualization"
+
     def setup_layout(self):
+        controls = []
+        if self.lattice is None:
+            controls = [
+                html.Div([
+                    dcc.Dropdown(list(structures.STRUCTURES), self.params['structure'], id='structure',
+                                 clearable=False, persistence=True, persistence_type='session',
+                                 style={'width': '200px'}),
+                    dcc.Input(id='box-size', type='number', value=self.params['size'], min=MIN_SESSION_SIZE,
+                              max=MAX_SESSION_SIZE, step=0.5, debounce=True, persistence=True,
+                              persistence_type='session'),
+                    dcc.Input(id='lattice-constant', type='number', value=self.params['a'], min=MIN_SESSION_SIZE,
+                              step=0.1, debounce=True, persistence=True, persistence_type='session'),
+                    html.Span(id='job-status'),
+                ], style={'display': 'flex', 'gap': '10px', 'align-items': 'center'}),
+                dcc.Interval(id='job-poll', interval=JOB_POLL_INTERVAL, disabled=True),
+                dcc.Store(id='job-store'),  # background job building the requested session
+            ]
         self.app.layout = html.Div([
-            html.H2("FCC Lattice Visualization"),
+            html.H2(self.page_title(self.params), id='page-title'),
+            *controls,
             dcc.Checklist(
                 options=[
                     {'label': 'Lattice Points', 'value': 'lattice'},
                     {'label': 'Basis Vectors', 'value': 'basis'},
                     {'label': 'Unit Cell', 'value': 'unit_cell'}
-                ],
-                value=['lattice', 'basis', 'unit_cell'],
+                ] + ([{'label': 'Bonds', 'value': 'bonds'}] if self.bonds is not None else []),
+                value=['lattice', 'basis', 'unit_cell'] + (['bonds'] if self.bonds is not None else []),
                 id='toggle-options',
                 labelStyle={'display': 'inline-block', 'margin': '10px'}
             ),
-            dcc.Graph(id='lattice-graph', style={'height': '80vh'}),
+            dcc.Graph(id='lattice-graph', figure=self.figure, style={'height': '80vh'}),
             dcc.Store(id='camera-store'),  # store camera/zoom
+            dcc.Store(id='lattice-params', storage_type='session', data=self.params),  # per-session structure
+            dcc.Store(id='shown-params', data=self.params),  # structure currently drawn in the graph
         ])
 
     def setup_callbacks(self):
-        @self.app.callback(
+        # camera/zoom is merged into camera-store in the browser, no server round-trip
+        self.app.clientside_callback(
+            """
+            function(relayoutData, stored) {
+                if (!relayoutData) {
+                    return window.dash_clientside.no_update;
+                }
+                const keys = {
+                    'scene.camera': 'camera',
+                    'scene.xaxis.range': 'x_range',
+                    'scene.yaxis.range': 'y_range',
+                    'scene.zaxis.range': 'z_range'
+                };
+                const data = Object.assign({}, stored || {});
+                let changed = false;
+                for (const [key, name] of Object.entries(keys)) {
+                    if (key in relayoutData) {
+                        data[name] = relayoutData[key];
+                        changed = true;
+                    }
+                }
+                return changed ? data : window.dash_clientside.no_update;
+            }
+            """,
             Output('camera-store', 'data'),
             Input('lattice-graph', 'relayoutData'),
+            State('camera-store', 'data'),
             prevent_initial_call=True
         )
-        def save_camera_data(relayout_data):
-            if not relayout_data:
-                return dash.no_update
-
-            return {
-                'camera': relayout_data.get('scene.camera'),
-                'x_range': relayout_data.get('scene.xaxis.range'),
-                'y_range': relayout_data.get('scene.yaxis.range'),
-                'z_range': relayout_data.get('scene.zaxis.range')
-            }
 
+        # toggles only flip 'visible' of the affected traces, the lattice points are never resent
         @self.app.callback(
             Output('lattice-graph', 'figure'),
             Input('toggle-options', 'value'),
-            Input('camera-store', 'data')
+            prevent_initial_call=True
         )
-        def update_figure(selected, camera_data):
-            camera = camera_data.get('camera') if camera_data else None
-            x_range = camera_data.get('x_range') if camera_data else None
-            y_range = camera_data.get('y_range') if camera_data else None
-            z_range = camera_data.get('z_range') if camera_data else None
-
-            return self.lattice.get_figure(
-                show_lattice='lattice' in selected,
-                show_basis='basis' in selected,
-                show_unit_cell='unit_cell' in selected,
-                camera=camera,
-                x_range=x_range,
-                y_range=y_range,
-                z_range=z_range
+        @metrics.timed('callback.update_figure')
+        def update_figure(selected):
+            patch = Patch()
+            for group, indices in self.trace_groups.items():
+                for index in indices:
+                    patch['data'][index]['visible'] = group in selected
+            return patch
+
+        if self.lattice is None:
+            @self.app.callback(
+                Output('lattice-params', 'data'),
+                Input('structure', 'value'),
+                Input('box-size', 'value'),
+                Input('lattice-constant', 'value'),
+                prevent_initial_call=True
+            )
+            def set_params(structure, size, a):
+                if structure is None or size is None or a is None:
+                    return dash.no_update
+                return self.clean_params({'structure': structure, 'size': size, 'a': a})
+
+            # the header follows the structure in the graph, not the requested one still being built
+            @self.app.callback(
+                Output('page-title', 'children'),
+                Input('shown-params', 'data')
+            )
+            def update_page_title(shown):
+                return self.page_title(shown or self.params)
+
+            # a new structure swaps in the cached base figure of its parameters, the toggles are kept;
+            # uncached structures are built by a background job when a JobManager is given
+            @self.app.callback(
+                Output('lattice-graph', 'figure', allow_duplicate=True),
+                Output('lattice-graph', 'extendData'),
+                Output('shown-params', 'data'),
+                Output('job-store', 'data'),
+                Output('job-poll', 'disabled'),
+                Output('job-status', 'children'),
+                Input('lattice-params', 'data'),
+                State('toggle-options', 'value'),
+                State('shown-params', 'data'),
+                State('job-store', 'data'),
+                prevent_initial_call='initial_duplicate'
+            )
+            @metrics.timed('callback.load_session')
+            def load_session(params, selected, shown, job):
+                params = self.clean_params(params or self.params)
+                shown = self.clean_params(shown or self.params)
+                if job:
+                    if job['params'] == params:
+                        return (dash.no_update,) * 6
+                    # the user moved on, the job is cancelled unless another session waits for it too
+                    self.jobs.release(job['id'])
+                if params == shown:
+                    return dash.no_update, dash.no_update, dash.no_update, None, True, ''
+                if self.jobs is not None and self.key(params) not in self.cache:
+                    job_id = self.jobs.submit(build_session_job, params, self.lod, self.max_points, self.binary,
+                                              self.bonds)
+                    return dash.no_update, dash.no_update, dash.no_update, {'id': job_id, 'params': params}, False, \
+                        'queued'
+                return self.show(params, shown, selected) + (params, None, True, '')
+
+            if self.jobs is not None:
+                @self.app.callback(
+                    Output('lattice-graph', 'figure', allow_duplicate=True),
+                    Output('lattice-graph', 'extendData', allow_duplicate=True),
+                    Output('shown-params', 'data', allow_duplicate=True),
+                    Output('job-store', 'data', allow_duplicate=True),
+                    Output('job-poll', 'disabled', allow_duplicate=True),
+                    Output('job-status', 'children', allow_duplicate=True),
+                    Input('job-poll', 'n_intervals'),
+                    State('job-store', 'data'),
+                    State('toggle-options', 'value'),
+                    State('shown-params', 'data'),
+                    prevent_initial_call=True
+                )
+                def poll_job(_, job, selected, shown):
+                    status = self.jobs.status(job['id']) if job else None
+                    if status is None or status['state'] in (JOB_CANCELLED, JOB_ERROR):
+                        message = status['error'] or status['state'] if status else ''
+                        return dash.no_update, dash.no_update, dash.no_update, None, True, message
+                    if status['state'] != JOB_DONE:
+                        return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, \
+                            f"{status['message'] or status['state']} {status['progress']:.0%}"
+                    params = job['params']
+                    entry, lod = self.jobs.result(job['id'])
+                    self.cache.put(self.key(params), entry)
+                    if lod is not None:
+                        self.cache.put(self.key(params) + '/lod', lod, disk=False)
+                    return self.show(params, self.clean_params(shown or self.params), selected) + (params, None, True, '')
+
+        if self.lod:
+            # camera changes only re-select the lattice points and their bonds, the small traces stay untouched
+            @self.app.callback(
+                Output('lattice-graph', 'figure', allow_duplicate=True),
+                Input('camera-store', 'data'),
+                State('shown-params', 'data'),
+                prevent_initial_call=True
             )
+            @metrics.timed('callback.update_level_of_detail')
+            def update_level_of_detail(camera_data, params):
+                # params of the structure in the graph, not the requested one a background job may still build;
+                # with a JobManager an evicted session is left to the next structure change instead of being
+                # rebuilt here
+                if self.jobs is not None and self.key(params or self.params) not in self.cache:
+                    return dash.no_update
+                camera_data = camera_data or {}
+                lod = self.level_of_detail(params or self.params)
+                rows = lod.select(lod.view_box(**camera_data))
+                metrics.observe('lod.points', len(rows))
+                lat = self.session(params or self.params)['lattice']
+                points = lat.points(rows)
+                patch = Patch()
+                index = self.trace_groups['lattice'][0]
+                for d, key in enumerate('xyz'):
+                    patch['data'][index][key] = encode_array(points[:, d]) if self.binary else points[:, d]
+                if self.bonds is not None:
+                    i, j, _ = lat.bonds(self.bonds, rows, points)
+                    segments = bond_network.segments(points[i], points[j])
+                    index = self.trace_groups['bonds'][0]
+                    for d, key in enumerate('xyz'):
+                        patch['data'][index][key] = encode_array(segments[:, d]) if self.binary else segments[:, d]
+                return patch
 
     def run(self, **kwargs):
         self.app.run(**kwargs)
\ No newline at end of file
@@ -0,0 +1,154 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import metrics
+from figure_cache import params_key
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks (Windows), trimming is then only safe within one process
+    fcntl = None
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'qts_visual', 'lattices')
+MAX_BYTES = 8 * 2**30
+LOCK_FILE = '.lock'
+META_FILE = 'meta.json'
+RECORDS_FILE = 'records.npy'
+POSITIONS_FILE = 'positions.npy'
+# bump when the stored layout changes, old entries are then simply never hit again
+VERSION = 1
+
+
+def lattice_key(basis_vectors, atomic_basis, box, position_dtype=np.float64):
+    # content address of a generated lattice: everything the atoms of lattice.lattice depend on
+    return params_key({'version': VERSION,
+                       'basis_vectors': np.asarray(basis_vectors, dtype=np.float64).tolist(),
+                       'atomic_basis': np.asarray(atomic_basis, dtype=np.float64).reshape(-1, 3).tolist(),
+                       'box': [[float(lo), float(hi)] for lo, hi in box],
+                       'dtype': np.dtype(position_dtype).str})
+
+
+class LatticeCache:
+    # content addressed directory of generated lattices, one subdirectory per lattice_key holding the integer
+    # records and the positions as .npy files; hits are memory mapped read-only, so every process opening the
+    # same entry shares the page cache instead of holding its own copy
+    # entries are written to a temporary directory and renamed into place, concurrent writers of the same key
+    # race harmlessly (the first rename wins); the total size is bounded, least recently used entries go first
+
+    def __init__(self, cache_dir=DEFAULT_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self._path(key), META_FILE))
+
+    def _count(self, stat, n=1):
+        self.stats[stat] += n
+        metrics.observe(f'lattice_cache.{stat}', n)
+
+    @contextmanager
+    def _locked(self):
+        # advisory lock over the whole directory, held while entries are renamed into place or evicted
+        with open(os.path.join(self.cache_dir, LOCK_FILE), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, key):
+        # (records, positions, meta) memory mapped read-only, None on a miss
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+                meta = json.load(f)
+            records = np.load(os.path.join(path, RECORDS_FILE), mmap_mode='r')
+            positions = np.load(os.path.join(path, POSITIONS_FILE), mmap_mode='r')
+            # access time for the LRU order
+            os.utime(os.path.join(path, META_FILE))
+        except (OSError, ValueError):
+            # missing, or evicted by another process while opening it
+            self._count('misses')
+            return None
+        self._count('hits')
+        return records, positions, meta
+
+    def put(self, key, records, positions, meta=None):
+        if key in self:
+            return
+        tmp = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp_')
+        try:
+            np.save(os.path.join(tmp, RECORDS_FILE), np.ascontiguousarray(records))
+            np.save(os.path.join(tmp, POSITIONS_FILE), np.ascontiguousarray(positions))
+            # written last, an entry counts as present once its meta file exists
+            with open(os.path.join(tmp, META_FILE), 'w', encoding='utf-8') as f:
+                json.dump(dict(meta or {}, created=time.time()), f)
+            with self._locked():
+                try:
+                    os.rename(tmp, self._path(key))
+                except OSError:
+                    # another writer stored the same key first
+                    pass
+                else:
+                    tmp = None
+                self._trim(keep=key)
+        finally:
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+    def _entries(self):
+        # (last access, bytes, key) of every stored entry
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            path = self._path(key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                access = os.stat(os.path.join(path, META_FILE)).st_mtime
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+            except OSError:
+                continue
+            entries.append((access, size, key))
+        return entries
+
+    def nbytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _trim(self, keep=None):
+        # evict least recently used entries until the cache fits max_bytes; processes that still map an
+        # evicted entry keep reading it, the files only disappear once they are unmapped
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+            self._count('evictions')
+
+    def clear(self):
+        with self._locked():
+            for _, _, key in self._entries():
+                shutil.rmtree(self._path(key), ignore_errors=True)
+
+
+# process wide cache used by lattice.lattice unless it is given one, QTS_LATTICE_CACHE=<directory> enables it
+default = LatticeCache(os.environ['QTS_LATTICE_CACHE'],
+                       int(os.environ.get('QTS_LATTICE_CACHE_BYTES', MAX_BYTES))) \
+    if os.environ.get('QTS_LATTICE_CACHE') else None
@@ -1,6 +1,9 @@
 import numpy as np
 import plotly.graph_objects as go
 from dash import Dash, dcc, html, Output, Input
+from figure_encoding import encode_figure
+from lattice import box_point_chunks
+import bonds
 
 
 class LatticeVisualizer:
@@ -16,20 +19,11 @@ class LatticeVisualizer:
         self.atomic_basis = atomic_basis
         self.basis_vectors = np.array([basis_vec_x, basis_vec_y, basis_vec_z])
 
-        self.metric_lattice = []
-        for i in range(int(range_x[0] / a_x), int(range_x[1] / a_x) + 1):
-            for j in range(int(range_y[0] / a_y), int(range_y[1] / a_y) + 1):
-                for k in range(int(range_z[0] / a_z), int(range_z[1] / a_z) + 1):
-                    for l in range(len(atomic_basis)):
-                        point = (i * basis_vec_x +
-                                 j * basis_vec_y +
-                                 k * basis_vec_z +
-                                 atomic_basis[l])
-                        self.metric_lattice.append(point)
+        box = (tuple(range_x), tuple(range_y), tuple(range_z))
+        chunks = list(box_point_chunks(self.basis_vectors, atomic_basis, box))
+        self.metric_lattice = np.concatenate(chunks) if chunks else np.empty((0, 3))
 
-        self.metric_lattice = np.array(self.metric_lattice)
-
-    def get_figure(self, show_lattice=True, show_basis=True, show_unit_cell=True):
+    def get_figure(self, show_lattice=True, show_basis=True, show_unit_cell=True, binary=False):
         fig = go.Figure()
 
         if show_lattice:
@@ -75,26 +69,7 @@ class LatticeVisualizer:
                 ))
 
         if show_unit_cell:
-            unit_cell_corners = np.array([
-                [0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1],
-                [1, 1, 0], [1, 0, 1], [0, 1, 1], [1, 1, 1]
-            ])
-            edges = [
-                (0, 1), (0, 2), (0, 3),
-                (1, 4), (1, 5),
-                (2, 4), (2, 6),
-                (3, 5), (3, 6),
-                (4, 7), (5, 7), (6, 7)
-            ]
-            for start, end in edges:
-                fig.add_trace(go.Scatter3d(
-                    x=[unit_cell_corners[start][0], unit_cell_corners[end][0]],
-                    y=[unit_cell_corners[start][1], unit_cell_corners[end][1]],
-                    z=[unit_cell_corners[start][2], unit_cell_corners[end][2]],
-                    mode='lines',
-                    line=dict(color='black', width=3),
-                    showlegend=False
-                ))
+            fig.add_trace(bonds.cell_edge_trace(np.eye(3)))
 
         fig.update_layout(
             scene=dict(
@@ -108,4 +83,4 @@ class LatticeVisualizer:
             title='Interactive FCC Lattice'
         )
 
-        return fig
+        return encode_figure(fig) if binary else fig
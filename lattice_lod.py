@@ -0,0 +1,91 @@
+import numpy as np
+
+DEFAULT_MAX_POINTS = 200_000
+# plotly's default camera eye as used in lattice.get_figure, the whole lattice is in view at this distance
+DEFAULT_EYE = np.array([1.5, 1.5, 1.5])
+
+
+class BoxIndex:
+    # uniform bucket grid over a point cloud for axis-aligned box queries
+    # points are sorted by bucket once, a query only touches the buckets overlapping the box
+
+    def __init__(self, points, points_per_bucket=64):
+        self.points = np.asarray(points)
+        n = len(self.points)
+        self.lower = self.points.min(axis=0) if n else np.zeros(3)
+        self.upper = self.points.max(axis=0) if n else np.zeros(3)
+        extent = np.maximum(self.upper - self.lower, 1e-12)
+        # roughly cubic buckets with points_per_bucket points on average
+        n_buckets = max(n / points_per_bucket, 1.0)
+        edge = (np.prod(extent) / n_buckets) ** (1 / 3)
+        self.shape = np.maximum(np.ceil(extent / edge), 1).astype(np.int64)
+        self.bucket_edge = extent / self.shape
+        bucket = self._bucket_ids(self._bucket_coords(self.points))
+        self.order = np.argsort(bucket, kind='stable')
+        self.starts = np.searchsorted(bucket[self.order], np.arange(np.prod(self.shape) + 1))
+
+    def _bucket_coords(self, points):
+        coords = np.floor((points - self.lower) / self.bucket_edge).astype(np.int64)
+        return np.clip(coords, 0, self.shape - 1)
+
+    def _bucket_ids(self, coords):
+        return np.ravel_multi_index(coords.T, self.shape)
+
+    def query(self, box):
+        # sorted rows of all points inside box = ((x0, x1), (y0, y1), (z0, z1))
+        box = np.asarray(box, dtype=np.float64)
+        if len(self.points) == 0 or np.any(box[:, 1] < self.lower) or np.any(box[:, 0] > self.upper):
+            return np.empty(0, dtype=np.int64)
+        lo, hi = self._bucket_coords(box.T)
+        axes = [np.arange(l, h + 1) for l, h in zip(lo, hi)]
+        buckets = self._bucket_ids(np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3))
+        starts, ends = self.starts[buckets], self.starts[buckets + 1]
+        counts = ends - starts
+        # concatenated ranges starts[b]:ends[b] without a python loop
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+        rows = self.order[np.arange(counts.sum()) + offsets]
+        inside = np.all((self.points[rows] >= box[:, 0]) & (self.points[rows] <= box[:, 1]), axis=1)
+        return np.sort(rows[inside])
+
+
+class LevelOfDetail:
+    # view-dependent subset of a lattice: only points inside the view box, at most max_points of them
+    # decimation keeps the points with the lowest fixed random priority, so zooming in only ever adds
+    # points to the ones already shown
+
+    def __init__(self, points, max_points=DEFAULT_MAX_POINTS, seed=0):
+        self.index = BoxIndex(points)
+        self.max_points = max_points
+        self.priority = np.random.default_rng(seed).permutation(len(points))
+
+    def full_box(self):
+        return np.stack((self.index.lower, self.index.upper), axis=1)
+
+    def select(self, box=None):
+        rows = self.index.query(self.full_box() if box is None else box)
+        if len(rows) > self.max_points:
+            keep = np.argpartition(self.priority[rows], self.max_points)[:self.max_points]
+            rows = np.sort(rows[keep])
+        return rows
+
+    def view_box(self, camera=None, x_range=None, y_range=None, z_range=None):
+        # explicit axis ranges win, otherwise the box is estimated from how far the camera eye is
+        # from its center relative to the default eye distance
+        box = self.full_box()
+        ranges = [x_range, y_range, z_range]
+        if any(r is not None for r in ranges):
+            for d, r in enumerate(ranges):
+                if r is not None:
+                    box[d] = sorted(r)
+            return box
+        if not camera or 'eye' not in camera:
+            return box
+        eye = np.array([camera['eye'][c] for c in 'xyz'], dtype=np.float64)
+        center = np.array([(camera.get('center') or {}).get(c, 0.0) for c in 'xyz'], dtype=np.float64)
+        zoom = np.linalg.norm(eye - center) / np.linalg.norm(DEFAULT_EYE)
+        if zoom >= 1:
+            return box
+        mid = box.mean(axis=1) + center * (box[:, 1] - box[:, 0]).max()
+        half = (box[:, 1] - box[:, 0]) / 2 * zoom
+        view = np.stack((mid - half, mid + half), axis=1)
+        return np.stack((np.maximum(view[:, 0], box[:, 0]), np.minimum(view[:, 1], box[:, 1])), axis=1)
@@ -0,0 +1,183 @@
+import cProfile
+import functools
+import hmac
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+# samples kept per histogram, percentiles are over this rolling window
+WINDOW = 1024
+PERCENTILES = (50, 90, 99)
+# profiles of the latest requests kept for /metrics/profile
+PROFILES = 20
+PROFILE_LINES = 40
+# secret the /metrics routes require, they are not served without one
+TOKEN_VARIABLE = 'QTS_METRICS_TOKEN'
+
+
+class Histogram:
+    # rolling window of samples plus lifetime count and sum
+
+    def __init__(self, window=WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        values = np.asarray(self.samples, dtype=np.float64)
+        summary = {'count': self.count, 'total': self.total, 'window': len(values)}
+        if len(values):
+            summary.update({'mean': float(values.mean()), 'max': float(values.max())})
+            summary.update({f'p{q}': float(v) for q, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))})
+        return summary
+
+
+class Metrics:
+    # named histograms of timings (seconds) and sizes/counts; everything is a no-op while disabled
+
+    def __init__(self, enabled=False, profile=False, window=WINDOW, profile_dir=None):
+        self.enabled = enabled
+        self.profile = profile
+        self.window = window
+        self.profile_dir = profile_dir
+        self.histograms = {}
+        self.profiles = deque(maxlen=PROFILES)
+        self.lock = threading.Lock()
+
+    def enable(self, profile=None):
+        self.enabled = True
+        if profile is not None:
+            self.profile = profile
+
+    def observe(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(self.window)
+            self.histograms[name].add(value)
+
+    def timer(self, name):
+        return self._timer(name) if self.enabled else nullcontext()
+
+    @contextmanager
+    def _timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        # decorator timing every call into the histogram name
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.profiles.clear()
+
+    def _store_profile(self, label, profiler):
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        with self.lock:
+            self.profiles.append({'label': label, 'time': time.time(), 'stats': stream.getvalue()})
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, f'{time.time_ns()}_{label.replace("/", "_")}.prof'))
+
+    def instrument(self, server, route='/metrics', token=None):
+        # request timing, response sizes and optional cProfile for every Dash request on the flask server,
+        # plus the JSON routes route (histograms) and route/profile (latest profiles); those are only served
+        # with a token (default: $QTS_METRICS_TOKEN), sent as 'Authorization: Bearer <token>' or ?token=<token>,
+        # since behind a reverse proxy the peer address says nothing about the client
+        import flask
+        token = token or os.environ.get(TOKEN_VARIABLE)
+
+        @server.before_request
+        def start_request():
+            if not self.enabled:
+                return
+            flask.g.metrics_start = time.perf_counter()
+            if self.profile and flask.request.path.startswith('/_dash-'):
+                flask.g.metrics_profiler = cProfile.Profile()
+                flask.g.metrics_profiler.enable()
+
+        @server.after_request
+        def finish_request(response):
+            start = flask.g.pop('metrics_start', None)
+            profiler = flask.g.pop('metrics_profiler', None)
+            if profiler is not None:
+                profiler.disable()
+            path = flask.request.path
+            if start is None or not path.startswith('/_dash-'):
+                return response
+            label = path
+            if path == '/_dash-update-component':
+                body = flask.request.get_json(silent=True) or {}
+                label = f'{path}/{body.get("output", "")}'
+            self.observe(f'request.time[{label}]', time.perf_counter() - start)
+            if not response.direct_passthrough:
+                self.observe(f'request.bytes[{label}]', response.calculate_content_length() or 0)
+            if profiler is not None:
+                self._store_profile(label, profiler)
+            return response
+
+        if not token:
+            return
+
+        def authorized():
+            header = flask.request.headers.get('Authorization', '')
+            given = header[len('Bearer '):] if header.startswith('Bearer ') else flask.request.args.get('token', '')
+            if not hmac.compare_digest(given.encode('utf-8'), token.encode('utf-8')):
+                flask.abort(403)
+
+        @server.route(route)
+        def metrics_route():
+            authorized()
+            return flask.Response(json.dumps({'enabled': self.enabled, 'profile': self.profile,
+                                              'metrics': self.snapshot()}, indent=1),
+                                  mimetype='application/json')
+
+        @server.route(route + '/profile')
+        def profile_route():
+            authorized()
+            with self.lock:
+                profiles = list(self.profiles)
+            return flask.Response(json.dumps(profiles, indent=1), mimetype='application/json')
+
+
+# process wide registry, QTS_METRICS=1 (QTS_PROFILE=1 for cProfile) enables it at import
+registry = Metrics(enabled=os.environ.get('QTS_METRICS', '') not in ('', '0'),
+                   profile=os.environ.get('QTS_PROFILE', '') not in ('', '0'),
+                   profile_dir=os.environ.get('QTS_PROFILE_DIR') or None)
+timer = registry.timer
+timed = registry.timed
+observe = registry.observe
@@ -0,0 +1,119 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+SHELL_TOLERANCE = 1e-6
+# atoms near the centre of the lattice used to find the shell radii
+SHELL_SAMPLE = 32
+# periodic images closer than this are the same atom, e.g. the atoms on opposite faces of a closed box
+DUPLICATE_TOLERANCE = 1e-9
+
+
+class NeighborIndex:
+    # KD-tree over lattice positions for k-nearest, radius and coordination-shell queries
+    # period: optional (Lx, Ly, Lz) of an orthorhombic periodic box starting at origin, distances then
+    # follow the minimum image convention; the box has to be commensurate with the lattice
+    # points that wrap onto each other (a closed box holds both faces) are kept once, rows are the indices
+    # of the kept ones in points, all rows of the index refer to self.points
+
+    def __init__(self, points, period=None, origin=None, leafsize=16):
+        self.points = np.asarray(points, dtype=np.float64)
+        self.period = None if period is None else np.asarray(period, dtype=np.float64)
+        self.origin = np.zeros(3) if origin is None else np.asarray(origin, dtype=np.float64)
+        self.rows = np.arange(len(self.points))
+        self.tree = cKDTree(self._wrap(self.points), leafsize=leafsize, boxsize=self.period)
+        if self.period is not None:
+            pairs = self.tree.query_pairs(DUPLICATE_TOLERANCE, output_type='ndarray')
+            if len(pairs):
+                self.rows = np.setdiff1d(self.rows, pairs.max(axis=1))
+                self.points = self.points[self.rows]
+                self.tree = cKDTree(self._wrap(self.points), leafsize=leafsize, boxsize=self.period)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _wrap(self, points):
+        if self.period is None:
+            return np.asarray(points, dtype=np.float64)
+        wrapped = np.mod(np.asarray(points, dtype=np.float64) - self.origin, self.period)
+        # np.mod can round up to the period itself for tiny negative values
+        return np.where(wrapped >= self.period, 0.0, wrapped)
+
+    def displacement(self, i, j):
+        # vectors from atoms i to atoms j, minimum image if periodic
+        d = self.points[j] - self.points[i]
+        if self.period is not None:
+            d -= self.period * np.round(d / self.period)
+        return d
+
+    def knn(self, k=1, query=None, workers=1):
+        # (distances, rows) of the k nearest atoms, shape (n, k)
+        # query None means all atoms, each atom itself is then left out
+        if query is None:
+            distances, rows = self.tree.query(self.tree.data, k=k + 1, workers=workers)
+            return distances[:, 1:], rows[:, 1:]
+        distances, rows = self.tree.query(self._wrap(np.atleast_2d(query)), k=k, workers=workers)
+        return distances.reshape(-1, k), rows.reshape(-1, k)
+
+    def radius(self, r, query, workers=1):
+        # rows within r of every query point, one array per query point
+        rows = self.tree.query_ball_point(self._wrap(np.atleast_2d(query)), r, workers=workers)
+        return [np.array(sorted(row), dtype=np.int64) for row in rows]
+
+    def count(self, r, query=None, workers=1):
+        # number of atoms within r, the atom itself not counted when query is None
+        points = self.tree.data if query is None else self._wrap(np.atleast_2d(query))
+        counts = self.tree.query_ball_point(points, r, workers=workers, return_length=True)
+        return counts - 1 if query is None else counts
+
+    def pairs(self, r):
+        # all pairs i < j closer than r as (i, j, distances), vectorized over all atoms
+        pairs = self.tree.query_pairs(r, output_type='ndarray')
+        i, j = pairs[:, 0], pairs[:, 1]
+        return i, j, np.linalg.norm(self.displacement(i, j), axis=1)
+
+    def shell_radii(self, n_shells=3, tol=SHELL_TOLERANCE):
+        # radii of the first n_shells coordination shells, taken from the atoms closest to the centre
+        if len(self) < 2:
+            return np.empty(0)
+        centre = self.points.mean(axis=0) if self.period is None else self.origin + self.period / 2
+        _, sample = self.tree.query(self._wrap(centre), k=min(SHELL_SAMPLE, len(self)))
+        sample = np.atleast_1d(sample)
+        k = 16 * n_shells
+        while True:
+            k = min(k, len(self) - 1)
+            distances, _ = self.tree.query(self.tree.data[sample], k=k + 1)
+            radii = _cluster(distances[:, 1:].ravel(), tol)
+            # the last shell found may be incomplete unless a farther distance was seen
+            if len(radii) > n_shells or k == len(self) - 1:
+                return radii[:n_shells]
+            k *= 2
+
+    def coordination_shells(self, n_shells=3, tol=SHELL_TOLERANCE, workers=1):
+        # (radii, counts): shell radii and per-atom number of neighbours in every shell, counts (N, n_shells)
+        radii = self.shell_radii(n_shells, tol)
+        if len(radii) == 0:
+            return radii, np.empty((len(self), 0), dtype=np.int64)
+        r_max = radii[-1] + tol
+        # one batched k-nearest query bounded by the outermost shell, k from the fullest sampled atom
+        k = int(self.count(r_max, self.tree.data[:: max(len(self) // SHELL_SAMPLE, 1)]).max()) + 1
+        k = min(k, len(self) - 1)
+        distances, _ = self.tree.query(self.tree.data, k=k + 1, distance_upper_bound=r_max, workers=workers)
+        distances = distances[:, 1:]
+        edges = np.concatenate(([0.0], radii + tol))
+        counts = np.stack([np.count_nonzero((distances > lo) & (distances <= hi), axis=1)
+                           for lo, hi in zip(edges[:-1], edges[1:])], axis=1)
+        # atoms whose k neighbours all lie inside r_max may have more, count those exactly
+        full = np.nonzero(np.isfinite(distances[:, -1]))[0]
+        if len(full):
+            cumulative = np.stack([self.count(r + tol, self.tree.data[full], workers) - 1 for r in radii], axis=1)
+            counts[full] = np.diff(cumulative, axis=1, prepend=0)
+        return radii, counts
+
+
+def _cluster(distances, tol):
+    # distinct values of distances, values closer than tol are merged
+    distances = np.sort(distances[np.isfinite(distances)])
+    if len(distances) == 0:
+        return distances
+    starts = np.concatenate(([True], np.diff(distances) > tol))
+    return distances[starts]
@@ -0,0 +1,155 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import plotly.graph_objects as go
+from scipy.spatial import cKDTree
+
+from neighbors import SHELL_TOLERANCE
+
+# upper bound for the number of pair distances held at once (24 bytes each)
+BLOCK_PAIRS = 2_000_000
+BINS = 200
+# centre atoms g(r) is averaged over by default, an evenly strided subset of larger lattices
+MAX_CENTERS = 100_000
+# default r_max in nearest neighbour distances
+R_MAX_SHELLS = 3.0
+
+# KD-tree of all atoms in a pool worker, built once by _init_worker
+_tree = None
+
+
+def _init_worker(data, period):
+    global _tree
+    _tree = cKDTree(data, boxsize=period)
+
+
+def _count_block(block, r_max, bins, period, tree=None):
+    # histogram of the distances 0 < d < r_max of all (centre in block, atom) pairs, bins of width r_max / bins
+    tree = _tree if tree is None else tree
+    distances = cKDTree(block, boxsize=period).sparse_distance_matrix(tree, r_max, output_type='ndarray')['v']
+    distances = distances[(distances > 0) & (distances < r_max)]
+    return np.bincount((distances * (bins / r_max)).astype(np.int64), minlength=bins)[:bins]
+
+
+def neighbor_index(lat, periodic=False):
+    # (NeighborIndex, rows of metric_lattice it holds); periodic uses the box as period, the box has to be
+    # commensurate with the lattice
+    if not periodic:
+        index = lat.neighbor_index()
+    else:
+        box = np.asarray(lat.box(), dtype=np.float64)
+        index = lat.neighbor_index(period=box[:, 1] - box[:, 0])
+    return index, index.rows
+
+
+def interior(points, box, margin):
+    # mask of the atoms at least margin away from every face of box, their neighbourhoods are complete
+    box = np.asarray(box, dtype=np.float64)
+    return np.all((points >= box[:, 0] + margin) & (points <= box[:, 1] - margin), axis=1)
+
+
+def number_density(lat):
+    # atoms per volume of the infinite crystal
+    return len(lat.atomic_basis) / abs(np.linalg.det(lat.basis_vectors))
+
+
+def pair_histogram(index, centers, r_max, bins=BINS, block_size=None, workers=1, progress=None):
+    # number of (centre, atom) pairs per distance bin [n, n + 1) * r_max / bins, centres: rows of the index
+    # blocks of centres are searched against the KD-tree of all atoms, block_size defaults to about
+    # BLOCK_PAIRS distances per block; workers > 1 spreads the blocks over a process pool
+    # progress(done, total) after every block
+    data = index.tree.data
+    if block_size is None:
+        # pairs per centre estimated from the atoms within r_max of a few centres
+        sample = centers[:: max(len(centers) // 64, 1)]
+        per_center = max(float(index.tree.query_ball_point(data[sample], r_max, return_length=True).mean()), 1.0)
+        block_size = max(int(BLOCK_PAIRS / per_center), 1)
+    blocks = [data[centers[start:start + block_size]] for start in range(0, len(centers), block_size)]
+    counts = np.zeros(bins, dtype=np.int64)
+    if workers and workers > 1 and len(blocks) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(data, index.period)) as pool:
+            n = len(blocks)
+            for done, block_counts in enumerate(pool.map(_count_block, blocks, [r_max] * n, [bins] * n,
+                                                         [index.period] * n)):
+                counts += block_counts
+                if progress is not None:
+                    progress(done + 1, n)
+    else:
+        for done, block in enumerate(blocks):
+            counts += _count_block(block, r_max, bins, index.period, index.tree)
+            if progress is not None:
+                progress(done + 1, len(blocks))
+    return counts
+
+
+def radial_distribution(lat, r_max=None, bins=BINS, periodic=False, max_centers=MAX_CENTERS, block_size=None,
+                        workers=1, progress=None):
+    # g(r) of a lattice.lattice: pair counts per shell over the ideal number in that shell,
+    # r_max defaults to R_MAX_SHELLS nearest neighbour distances
+    # open boxes only use centres at least r_max from every face, periodic boxes use minimum images and all atoms;
+    # of those at most max_centers (None: all) evenly spread ones are averaged over
+    index, _ = neighbor_index(lat, periodic)
+    if r_max is None:
+        r_max = R_MAX_SHELLS * index.shell_radii(1)[0]
+    if periodic and r_max > index.period.min() / 2:
+        raise ValueError(f"r_max {r_max} exceeds half the smallest box length {index.period.min() / 2}")
+    if periodic:
+        centers = np.arange(len(index))
+    else:
+        centers = np.flatnonzero(interior(index.points, lat.box(), r_max))
+    if len(centers) == 0:
+        raise ValueError(f"no atom is r_max={r_max} away from the box faces, use a larger box or a smaller r_max")
+    if max_centers is not None and len(centers) > max_centers:
+        centers = centers[np.linspace(0, len(centers) - 1, max_centers).astype(np.int64)]
+    edges = np.linspace(0.0, r_max, bins + 1)
+    counts = pair_histogram(index, centers, r_max, bins, block_size, workers, progress)
+    density = number_density(lat)
+    ideal = len(centers) * density * 4 / 3 * np.pi * np.diff(edges ** 3)
+    return {'r': (edges[:-1] + edges[1:]) / 2, 'g': counts / ideal, 'edges': edges, 'counts': counts,
+            'centers': len(centers), 'density': density}
+
+
+def coordination_histogram(lat, n_shells=1, periodic=False, workers=1):
+    # shell radii and, per shell, how many atoms have 0, 1, 2, ... neighbours in it (surface atoms included)
+    index, _ = neighbor_index(lat, periodic)
+    radii, counts = index.coordination_shells(n_shells, workers=workers)
+    return {'radii': radii, 'histograms': [np.bincount(counts[:, shell]) for shell in range(len(radii))]}
+
+
+def neighbor_table(lat, n_shells=3, periodic=False, workers=1):
+    # one row per basis atom and shell: radius and coordination number of the bulk, i.e. of the atoms whose
+    # shells lie completely inside the box (all atoms if periodic); atoms lists how many atoms were seen
+    index, rows = neighbor_index(lat, periodic)
+    radii, counts = index.coordination_shells(n_shells, workers=workers)
+    basis_index = lat.countable_lattice.basis_index[lat.visible_rows()[rows]]
+    bulk = np.ones(len(index), dtype=bool)
+    if not periodic and len(radii):
+        bulk = interior(index.points, lat.box(), radii[-1] + SHELL_TOLERANCE)
+    table = []
+    for l in range(len(lat.atomic_basis)):
+        atoms = bulk & (basis_index == l)
+        for shell, radius in enumerate(radii):
+            values, frequency = np.unique(counts[atoms, shell], return_counts=True)
+            table.append({'basis': l, 'shell': shell + 1, 'radius': float(radius),
+                          'coordination': int(values[np.argmax(frequency)]) if len(values) else None,
+                          'atoms': int(np.count_nonzero(atoms))})
+    return table
+
+
+def get_rdf_figure(result, title='Radial Distribution Function'):
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=result['r'],
+        y=result['g'],
+        mode='lines',
+        line=dict(color='blue', width=2),
+        name='g(r)'
+    ))
+    fig.add_hline(y=1, line=dict(color='gray', dash='dash'))
+    fig.update_layout(
+        xaxis=dict(title='r'),
+        yaxis=dict(title='g(r)'),
+        margin=dict(l=0, r=0, b=0, t=30),
+        title=title
+    )
+    return fig
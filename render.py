@@ -0,0 +1,200 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import figure_encoding
+
+MANIFEST = '.render_manifest.json'
+FORMATS = ('html', 'json')
+HERE = os.path.dirname(os.path.abspath(__file__))
+# source files whose changes invalidate the outputs of a job kind
+SOURCES = {
+    'lattice': ['lattice.py', 'structures.py', 'lattice_lod.py', 'neighbors.py', 'bonds.py'],
+    'bcc': ['bcc.py', 'wigner_seitz.py', 'bonds.py'],
+    'laguerre': ['laguerre_3D.py', 'laguerre_modes.py'],
+    'powder': ['diffraction.py', 'wigner_seitz.py', 'structures.py', 'lattice.py'],
+    'rdf': ['rdf.py', 'neighbors.py', 'structures.py', 'lattice.py'],
+}
+COMMON_SOURCES = ['render.py', 'figure_encoding.py']
+# job keys that only affect how a figure is written, not how it is built
+OUTPUT_KEYS = ('kind', 'name', 'binary')
+
+
+def build_figure(job):
+    # figure for a job dict, e.g. {'kind': 'lattice', 'structure': 'fcc', 'size': 3}
+    params = {key: value for key, value in job.items() if key not in OUTPUT_KEYS}
+    kind = job['kind']
+    if kind == 'lattice':
+        import structures
+        figure_options = {key: params.pop(key) for key in ('show_lattice', 'show_basis', 'show_unit_cell',
+                                                           'bonds', 'show_bonds') if key in params}
+        return structures.build(params.pop('structure'), **params).get_figure(**figure_options)
+    if kind == 'bcc':
+        import bcc
+        return bcc.get_figure(**params)
+    if kind == 'laguerre':
+        import laguerre_3D
+        return laguerre_3D.get_figure(**params)
+    if kind == 'powder':
+        import diffraction
+        import structures
+        pattern_options = {key: params.pop(key) for key in ('wavelength', 'two_theta_max') if key in params}
+        lat = structures.build(params.pop('structure'), **params)
+        return diffraction.get_powder_figure(diffraction.powder_pattern(lat, **pattern_options))
+    if kind == 'rdf':
+        import rdf
+        import structures
+        rdf_options = {key: params.pop(key) for key in ('r_max', 'bins', 'periodic', 'max_centers') if key in params}
+        lat = structures.build(params.pop('structure'), **params)
+        return rdf.get_rdf_figure(rdf.radial_distribution(lat, **rdf_options))
+    raise ValueError(f"unknown job kind {kind!r}, choose one of {', '.join(SOURCES)}")
+
+
+def job_name(job):
+    if 'name' in job:
+        return job['name']
+    parts = [job['kind']] + [f'{key}{value}' for key, value in sorted(job.items()) if key not in OUTPUT_KEYS]
+    # binary changes the written file, so jobs differing only in it must not share an output
+    if job.get('binary'):
+        parts.append('binary')
+    return re.sub(r'[^A-Za-z0-9_.=-]+', '_', '-'.join(parts))
+
+
+def _source_digest(kind):
+    digest = hashlib.sha256()
+    for name in COMMON_SOURCES + SOURCES.get(kind, []):
+        with open(os.path.join(HERE, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def job_hash(job, fmt, source_digest):
+    # changes whenever the job parameters, the output format or the code behind the job kind change
+    payload = json.dumps({'job': job, 'format': fmt, 'sources': source_digest}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def render_job(job, outputs):
+    # build the figure once and write all requested outputs, outputs: [(format, path)]
+    start = time.perf_counter()
+    fig = build_figure(job)
+    built = time.perf_counter() - start
+    binary = bool(job.get('binary', False))
+    for fmt, path in outputs:
+        tmp = f'{path}.tmp{os.getpid()}'
+        if fmt == 'html':
+            figure_encoding.write_html(fig, tmp, binary=binary, auto_open=False)
+        else:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(figure_encoding.to_json(fig, binary))
+        os.replace(tmp, path)
+    return built, time.perf_counter() - start
+
+
+def _parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def expand_grid(grid):
+    # {'structure': ['sc', 'fcc'], 'size': [2, 4]} -> one job per combination
+    keys = list(grid)
+    values = [value if isinstance(value, list) else [value] for value in grid.values()]
+    return [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+
+
+def load_jobs(sweep=None, grid=None):
+    jobs = []
+    if sweep:
+        with open(sweep, encoding='utf-8') as f:
+            spec = json.load(f)
+        for entry in spec if isinstance(spec, list) else [spec]:
+            jobs += expand_grid(entry)
+    if grid:
+        jobs += expand_grid({key: [_parse_value(v) for v in value.split(',')]
+                             for key, value in (item.split('=', 1) for item in grid)})
+    return jobs
+
+
+def _load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def render(jobs, out_dir='renders', formats=('html',), workers=None, force=False):
+    # renders all jobs whose outputs are missing or whose input hash changed, returns {name: seconds}
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = _load_manifest(out_dir)
+    digests = {kind: _source_digest(kind) for kind in {job['kind'] for job in jobs}}
+    todo = []
+    for job in jobs:
+        name = job_name(job)
+        outputs, hashes = [], {}
+        for fmt in formats:
+            filename = f'{name}.{fmt}'
+            hashes[filename] = job_hash(job, fmt, digests[job['kind']])
+            path = os.path.join(out_dir, filename)
+            if force or manifest.get(filename) != hashes[filename] or not os.path.exists(path):
+                outputs.append((fmt, path))
+        if outputs:
+            todo.append((name, job, outputs, hashes))
+        else:
+            print(f'{name}: up to date')
+
+    timings = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_job, job, outputs): (name, outputs, hashes)
+                   for name, job, outputs, hashes in todo}
+        for future in as_completed(futures):
+            name, outputs, hashes = futures[future]
+            try:
+                built, total = future.result()
+            except Exception as error:
+                print(f'{name}: failed: {error!r}')
+                continue
+            for _, path in outputs:
+                filename = os.path.basename(path)
+                manifest[filename] = hashes[filename]
+            timings[name] = total
+            print(f'{name}: build {built:.3f} s, total {total:.3f} s')
+    _write_manifest(out_dir, manifest)
+    print(f'{len(timings)} of {len(jobs)} jobs rendered in {time.perf_counter() - start:.3f} s')
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render lattice and wave figures for a parameter sweep.')
+    parser.add_argument('--sweep', help='JSON file with a job dict or a list of them, list values are swept')
+    parser.add_argument('--grid', nargs='*', metavar='KEY=V1,V2',
+                        help='parameter grid, e.g. kind=lattice structure=sc,fcc size=2,4')
+    parser.add_argument('--out', default='renders', help='output directory')
+    parser.add_argument('--format', nargs='+', choices=FORMATS, default=['html'], dest='formats')
+    parser.add_argument('--workers', type=int, default=None, help='processes, default: all cores')
+    parser.add_argument('--force', action='store_true', help='render even if the input hash is unchanged')
+    args = parser.parse_args(argv)
+    jobs = load_jobs(args.sweep, args.grid)
+    if not jobs:
+        parser.error('nothing to render, give --sweep and/or --grid')
+    render(jobs, args.out, args.formats, args.workers, args.force)
+
+
+if __name__ == '__main__':
+    main()
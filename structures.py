@@ -0,0 +1,36 @@
+import numpy as np
+import lattice
+
+# Bravais lattice vectors (rows, in units of a) and fractional atomic basis of the structures listed in run.py
+STRUCTURES = ('sc', 'fcc', 'bcc', 'hexagonal', 'graphite')
+# default c / a of the hexagonal structures
+C_OVER_A = {'hexagonal': 1.0, 'graphite': 2.72}
+
+
+def preset(name, a=1.0, c=None):
+    # (basis_vectors, atomic_basis) with the atomic basis in cartesian coordinates
+    if name == 'sc':
+        basis_vectors = a * np.eye(3)
+        fractional = [[0, 0, 0]]
+    elif name == 'fcc':
+        basis_vectors = a * np.array([[0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+        fractional = [[0, 0, 0]]
+    elif name == 'bcc':
+        basis_vectors = a * np.array([[-0.5, 0.5, 0.5], [0.5, -0.5, 0.5], [0.5, 0.5, -0.5]])
+        fractional = [[0, 0, 0]]
+    elif name in ('hexagonal', 'graphite'):
+        c = c if c is not None else C_OVER_A[name] * a
+        basis_vectors = np.array([a * np.array([1, 0, 0]), a * np.array([0.5, np.sqrt(3) / 2, 0]), c * np.array([0, 0, 1])])
+        # a1, a2 enclose 60 degrees, so the two hollow sites of a layer are (1/3, 1/3) and (2/3, 2/3)
+        fractional = [[0, 0, 0]] if name == 'hexagonal' else [[0, 0, 0], [1/3, 1/3, 0], [0, 0, 1/2], [2/3, 2/3, 1/2]]
+    else:
+        raise ValueError(f"unknown structure {name!r}, choose one of {', '.join(STRUCTURES)}")
+    return basis_vectors, np.asarray(fractional, dtype=np.float64) @ basis_vectors
+
+
+def build(name, size=2.0, a=1.0, c=None, **kwargs):
+    # lattice.lattice of the preset filling the box [-size, size]^3
+    basis_vectors, atomic_basis = preset(name, a, c)
+    c = np.linalg.norm(basis_vectors[2])
+    return lattice.lattice([-size, size], [-size, size], [-size, size], a, a, c, atomic_basis, *basis_vectors, name,
+                           **kwargs)
@@ -0,0 +1,163 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import plotly.graph_objects as go
+
+from lattice import box_cell_ranges, lattice_points
+from wigner_seitz import reciprocal_basis
+
+SHELL_TOLERANCE = 1e-6
+# k-points diagonalized together
+K_CHUNK = 50_000
+
+# high symmetry points of the cubic lattices in units of 2 pi / a (a = conventional lattice constant)
+HIGH_SYMMETRY_POINTS = {
+    'sc': {'Γ': (0, 0, 0), 'X': (0, 0.5, 0), 'M': (0.5, 0.5, 0), 'R': (0.5, 0.5, 0.5)},
+    'fcc': {'Γ': (0, 0, 0), 'X': (0, 1, 0), 'W': (0.5, 1, 0), 'K': (0.75, 0.75, 0), 'L': (0.5, 0.5, 0.5)},
+    'bcc': {'Γ': (0, 0, 0), 'H': (0, 1, 0), 'N': (0.5, 0.5, 0), 'P': (0.5, 0.5, 0.5)},
+}
+
+# (structure, hoppings, onsite, mesh, bins) -> (energies, dos)
+_dos_cache = {}
+
+
+def hopping_list(basis_vectors, atomic_basis, n_shells, tol=SHELL_TOLERANCE):
+    # (src, dst, d, shell) for all hops from basis atom src to the copy of basis atom dst at d = R + b_dst - b_src
+    # in the first n_shells neighbour shells, shells counted over the whole structure
+    basis_vectors = np.asarray(basis_vectors, dtype=np.float64)
+    atomic_basis = np.asarray(atomic_basis, dtype=np.float64).reshape(-1, 3)
+    n_basis = len(atomic_basis)
+    src, dst = np.meshgrid(np.arange(n_basis), np.arange(n_basis), indexing='ij')
+    src, dst = src.ravel(), dst.ravel()
+    offsets = atomic_basis[dst] - atomic_basis[src]
+    r = np.linalg.norm(basis_vectors, axis=1).max() * n_shells
+    while True:
+        box = ((-r, r),) * 3
+        cells = lattice_points(np.eye(3), np.zeros((1, 3)), box_cell_ranges(basis_vectors, offsets, box))
+        d = (cells @ basis_vectors)[:, None, :] + offsets[None, :, :]
+        norm = np.linalg.norm(d, axis=2)
+        distances = np.sort(norm[(norm > tol) & (norm <= r)])
+        shells = distances[np.concatenate(([True], np.diff(distances) > tol))] if len(distances) else distances
+        # every vector up to radius r is enumerated, so the shells below r are complete
+        if len(shells) >= n_shells:
+            break
+        r *= 2
+    shells = shells[:n_shells]
+    shell = np.searchsorted(shells + tol, norm)
+    keep = (norm > tol) & (shell < n_shells) & (np.abs(norm - shells[np.minimum(shell, n_shells - 1)]) <= tol)
+    cell_idx, pair = np.nonzero(keep)
+    return src[pair], dst[pair], d[cell_idx, pair], shell[keep], shells
+
+
+def k_path(points, n_per_segment=100):
+    # (k, distance, tick_positions) along the straight segments between the cartesian points
+    points = np.asarray(points, dtype=np.float64)
+    t = np.linspace(0, 1, n_per_segment, endpoint=False)[:, None]
+    k = np.concatenate([a + t * (b - a) for a, b in zip(points[:-1], points[1:])] + [points[-1:]])
+    distance = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(k, axis=0), axis=1))))
+    ticks = distance[::n_per_segment]
+    return k, distance, ticks
+
+
+def monkhorst_pack(basis_vectors, mesh):
+    # cartesian k-points of an n1 x n2 x n3 Monkhorst-Pack mesh over the Brillouin zone
+    axes = [(2 * np.arange(1, n + 1) - n - 1) / (2 * n) for n in mesh]
+    frac = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+    return frac @ reciprocal_basis(basis_vectors)
+
+
+class TightBinding:
+    # H(k)_lm = onsite_l delta_lm + sum over hops l -> m of t_shell exp(i k . d)
+    # hoppings: one hopping energy per neighbour shell, nearest shell first
+
+    def __init__(self, basis_vectors, atomic_basis, hoppings, onsite=0.0, tol=SHELL_TOLERANCE):
+        self.basis_vectors = np.asarray(basis_vectors, dtype=np.float64)
+        self.atomic_basis = np.asarray(atomic_basis, dtype=np.float64).reshape(-1, 3)
+        self.hoppings = tuple(float(t) for t in hoppings)
+        self.n_basis = len(self.atomic_basis)
+        self.onsite = np.broadcast_to(np.asarray(onsite, dtype=np.float64), (self.n_basis,)).copy()
+        src, dst, self.d, shell, self.shells = hopping_list(self.basis_vectors, self.atomic_basis,
+                                                            len(self.hoppings), tol)
+        self.t = np.asarray(self.hoppings)[shell]
+        # one-hot map from hops to flattened matrix entries, so H is a single matrix product
+        self.entries = np.zeros((len(self.t), self.n_basis * self.n_basis))
+        self.entries[np.arange(len(self.t)), src * self.n_basis + dst] = 1.0
+
+    @classmethod
+    def from_lattice(cls, lattice, hoppings, onsite=0.0):
+        return cls(lattice.basis_vectors, lattice.atomic_basis, hoppings, onsite)
+
+    def key(self):
+        return (np.round(self.basis_vectors, 10).tobytes(), np.round(self.atomic_basis, 10).tobytes(),
+                self.hoppings, self.onsite.tobytes())
+
+    def hamiltonian(self, k):
+        # stacked H(k), shape (len(k), n_basis, n_basis)
+        k = np.asarray(k, dtype=np.float64).reshape(-1, 3)
+        weights = np.exp(1j * (k @ self.d.T)) * self.t
+        h = (weights @ self.entries).reshape(-1, self.n_basis, self.n_basis)
+        h[:, np.arange(self.n_basis), np.arange(self.n_basis)] += self.onsite
+        return h
+
+    def bands(self, k, chunk_size=K_CHUNK):
+        # eigenvalues for every k-point, shape (len(k), n_basis), one batched eigen-solve per chunk
+        k = np.asarray(k, dtype=np.float64).reshape(-1, 3)
+        out = np.empty((len(k), self.n_basis))
+        for start in range(0, len(k), chunk_size):
+            out[start:start + chunk_size] = np.linalg.eigvalsh(self.hamiltonian(k[start:start + chunk_size]))
+        return out
+
+    def energy_bounds(self):
+        # Gershgorin bounds of all eigenvalues
+        radius = np.abs(self.t) @ self.entries.reshape(-1, self.n_basis, self.n_basis).sum(axis=2)
+        return float((self.onsite - radius).min()), float((self.onsite + radius).max())
+
+    def dos(self, mesh=(20, 20, 20), bins=400, workers=None, chunk_size=K_CHUNK):
+        # (energies, dos) histogram over a Monkhorst-Pack mesh, normalized to n_basis states per cell;
+        # workers > 1 spreads mesh chunks over a process pool, results are cached per model and mesh
+        key = (self.key(), tuple(mesh), bins)
+        if key not in _dos_cache:
+            lo, hi = self.energy_bounds()
+            edges = np.linspace(lo - 1e-9, hi + 1e-9, bins + 1)
+            k = monkhorst_pack(self.basis_vectors, mesh)
+            chunks = [k[start:start + chunk_size] for start in range(0, len(k), chunk_size)]
+            if workers and workers > 1 and len(chunks) > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    counts = sum(pool.map(_dos_chunk, [self] * len(chunks), chunks, [edges] * len(chunks)))
+            else:
+                counts = sum(_dos_chunk(self, chunk, edges) for chunk in chunks)
+            dos = counts / (len(k) * np.diff(edges))
+            _dos_cache[key] = ((edges[:-1] + edges[1:]) / 2, dos)
+        return _dos_cache[key]
+
+
+def _dos_chunk(model, k, edges):
+    return np.histogram(model.bands(k), bins=edges)[0]
+
+
+def get_band_figure(distance, energies, ticks=None, labels=None, title='Band Structure'):
+    fig = go.Figure()
+    for n in range(energies.shape[1]):
+        fig.add_trace(go.Scatter(
+            x=distance, y=energies[:, n],
+            mode='lines',
+            line=dict(color='blue', width=2),
+            showlegend=False
+        ))
+    fig.update_layout(
+        xaxis=dict(title='k', tickvals=ticks, ticktext=labels, showgrid=True),
+        yaxis=dict(title='E'),
+        margin=dict(l=0, r=0, b=0, t=30),
+        title=title
+    )
+    return fig
+
+
+def get_dos_figure(energies, dos, title='Density of States'):
+    fig = go.Figure(go.Scatter(x=energies, y=dos, mode='lines', line=dict(color='blue', width=2), name='DOS'))
+    fig.update_layout(
+        xaxis=dict(title='E'),
+        yaxis=dict(title='DOS'),
+        margin=dict(l=0, r=0, b=0, t=30),
+        title=title
+    )
+    return fig
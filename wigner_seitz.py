@@ -0,0 +1,112 @@
+from collections import namedtuple
+import numpy as np
+import plotly.graph_objects as go
+from scipy.spatial import Voronoi, ConvexHull
+
+from lattice import box_cell_ranges, lattice_points
+
+# vertices (n, 3), triangles (m, 3) and polyhedron edges (e, 2) indexing into vertices
+Polyhedron = namedtuple('Polyhedron', ['vertices', 'simplices', 'edges'])
+
+# canonical key of the lattice vectors -> Polyhedron
+_cells = {}
+KEY_DECIMALS = 10
+
+
+def reciprocal_basis(basis_vectors):
+    # rows b_i with a_i . b_j = 2 pi delta_ij
+    return 2 * np.pi * np.linalg.inv(np.asarray(basis_vectors, dtype=np.float64)).T
+
+
+def _key(basis_vectors):
+    return tuple(np.round(np.asarray(basis_vectors, dtype=np.float64), KEY_DECIMALS).ravel().tolist())
+
+
+def _neighbor_points(basis_vectors):
+    # the origin and every lattice point that can bound its Voronoi cell: the cell lies within the covering
+    # radius, at most (|a1| + |a2| + |a3|) / 2, so only points R with |R| <= |a1| + |a2| + |a3| matter
+    r_max = np.linalg.norm(basis_vectors, axis=1).sum()
+    box = ((-r_max, r_max),) * 3
+    points = lattice_points(basis_vectors, np.zeros((1, 3)), box_cell_ranges(basis_vectors, np.zeros((1, 3)), box))
+    points = points[np.linalg.norm(points, axis=1) <= r_max * (1 + 1e-9)]
+    # origin first so its Voronoi region is region of point 0
+    origin = np.argmin(np.linalg.norm(points, axis=1))
+    return np.concatenate((points[origin:origin + 1], np.delete(points, origin, axis=0)))
+
+
+def _hull_edges(hull, tol=1e-8):
+    # edges between facets that are not coplanar, i.e. without the triangulation diagonals
+    simplices = hull.simplices
+    edges = np.concatenate((simplices[:, [0, 1]], simplices[:, [1, 2]], simplices[:, [0, 2]]))
+    edges.sort(axis=1)
+    facets = np.tile(np.arange(len(simplices)), 3)
+    order = np.lexsort((edges[:, 1], edges[:, 0]))
+    edges, facets = edges[order], facets[order]
+    # a closed triangulated surface has every edge exactly twice, after sorting the two are adjacent
+    normals = hull.equations[:, :3]
+    same_plane = np.einsum('ij,ij->i', normals[facets[0::2]], normals[facets[1::2]]) > 1 - tol
+    return edges[0::2][~same_plane]
+
+
+def wigner_seitz_cell(basis_vectors):
+    # Wigner-Seitz cell of the Bravais lattice spanned by the rows of basis_vectors, cached per lattice
+    key = _key(basis_vectors)
+    if key not in _cells:
+        vor = Voronoi(_neighbor_points(np.asarray(basis_vectors, dtype=np.float64)))
+        region = vor.regions[vor.point_region[0]]
+        if -1 in region or len(region) == 0:
+            raise ValueError("Unbounded or empty Voronoi region!")
+        vertices = vor.vertices[region]
+        hull = ConvexHull(vertices)
+        _cells[key] = Polyhedron(vertices, hull.simplices, _hull_edges(hull))
+    return _cells[key]
+
+
+def brillouin_zone(basis_vectors):
+    # first Brillouin zone = Wigner-Seitz cell of the reciprocal lattice
+    return wigner_seitz_cell(reciprocal_basis(basis_vectors))
+
+
+def polyhedron_traces(cell, centers=((0, 0, 0),), name='Wigner-Seitz Cell', color='lightblue', opacity=0.25,
+                      edge_color='black', edge_width=3):
+    # one Mesh3d and one edge trace for copies of cell translated to every row of centers
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+    n_vertices = len(cell.vertices)
+    vertices = (centers[:, None, :] + cell.vertices[None, :, :]).reshape(-1, 3)
+    simplices = (cell.simplices[None, :, :] + n_vertices * np.arange(len(centers))[:, None, None]).reshape(-1, 3)
+    # every edge as start, end, NaN so all segments go into a single line trace
+    segments = np.full((len(centers), len(cell.edges), 3, 3), np.nan)
+    segments[:, :, 0] = centers[:, None, :] + cell.vertices[cell.edges[:, 0]][None]
+    segments[:, :, 1] = centers[:, None, :] + cell.vertices[cell.edges[:, 1]][None]
+    segments = segments.reshape(-1, 3)
+
+    mesh = go.Mesh3d(
+        x=vertices[:, 0],
+        y=vertices[:, 1],
+        z=vertices[:, 2],
+        i=simplices[:, 0],
+        j=simplices[:, 1],
+        k=simplices[:, 2],
+        opacity=opacity,
+        color=color,
+        name=name,
+        showscale=False
+    )
+    edges = go.Scatter3d(
+        x=segments[:, 0], y=segments[:, 1], z=segments[:, 2],
+        mode='lines',
+        line=dict(color=edge_color, width=edge_width),
+        name=f'{name} Edges',
+        showlegend=False
+    )
+    return mesh, edges
+
+
+def add_wigner_seitz_cells(fig, basis_vectors, centers=((0, 0, 0),), **kwargs):
+    # one cached polyhedron, translated to all centers
+    fig.add_traces(polyhedron_traces(wigner_seitz_cell(basis_vectors), centers, **kwargs))
+
+
+def add_brillouin_zone(fig, basis_vectors, **kwargs):
+    kwargs.setdefault('name', 'Brillouin Zone')
+    fig.add_traces(polyhedron_traces(brillouin_zone(basis_vectors), **kwargs))